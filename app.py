@@ -1,21 +1,54 @@
 import streamlit as st
-import pandas as pd
 import json
 import os
 import io
-import requests
+import importlib
+import importlib.util
 import shutil
+import tempfile
 import re
+import threading
+import time
+import logging
 import base64
+from urllib.parse import quote
+import hashlib
+import numbers
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from types import MappingProxyType
 from datetime import datetime, timedelta
 from base64 import b64decode
+from contextlib import contextmanager
 
-# محاولة استيراد PyGithub (لرفع التعديلات)
-try:
+# ===============================
+# ⏳ استيراد المكتبات الثقيلة عند أول استخدام فقط
+# ===============================
+class _LazyModule:
+    """وحدة تُستورد عند أول استخدام لها (شاشة الدخول لا تحتاج pandas أو GitHub)"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+logger = logging.getLogger("luva")
+
+pd = _LazyModule("pandas")
+requests = _LazyModule("requests")
+pa = _LazyModule("pyarrow")
+sheet_workers = _LazyModule("sheet_workers")
+
+# التحقق من وجود PyGithub (لرفع التعديلات) و pyarrow (للكاش المشترك) دون استيرادهما
+GITHUB_AVAILABLE = importlib.util.find_spec("github") is not None
+ARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+def github_client(token):
+    """عميل PyGithub (يُستورد عند أول رفع أو تحميل عبر API)"""
     from github import Github
-    GITHUB_AVAILABLE = True
-except Exception:
-    GITHUB_AVAILABLE = False
+    return Github(token)
 
 # ===============================
 # ⚙ إعدادات التطبيق - نظام إدارة محطات الإنتاج
@@ -37,13 +70,55 @@ APP_CONFIG = {
     
     # إعدادات الواجهة
     "SHOW_TECH_SUPPORT_TO_ALL": True,
-    "CUSTOM_TABS": ["📊 عرض المحطات", "✏ تعديل البيانات", "👥 إدارة المستخدمين", "📞 الدعم الفني"],
+    "CUSTOM_TABS": ["📊 عرض المحطات", "✏ تعديل البيانات", "📈 تحليلات الأعطال", "👥 إدارة المستخدمين", "📞 الدعم الفني"],
     
     # إعدادات الحفظ التلقائي
     "AUTO_SAVE": True,  # تفعيل الحفظ التلقائي افتراضياً
     
     # الأعمدة الإلزامية التي يجب أن تظهر دائماً
-    "MANDATORY_COLUMNS": ["الحدث", "التصحيح الفني", "التاريخ"]
+    "MANDATORY_COLUMNS": ["الحدث", "التصحيح الفني", "التاريخ"],
+
+    # التحقق من الصفوف المعدلة قبل الحفظ (حقول إلزامية، تواريخ، أنواع الأعمدة)
+    "VALIDATE_BEFORE_SAVE": True,
+
+    # أعمدة تحليلات الأعطال
+    "EVENT_COLUMN": "الحدث",
+    "DATE_COLUMN": "التاريخ",
+    "TOP_RECURRING_EVENTS": 20,
+    
+    # أرشفة السجلات القديمة (حسب عمود التاريخ) في ملفات سنوية خارج الملف النشط
+    "ARCHIVE_AFTER_DAYS": 365,
+    "ARCHIVE_DIR": "archive",  # نفس المسار محلياً وفي المستودع
+    
+    # إعدادات استنتاج أنواع الأعمدة
+    "CATEGORY_MAX_RATIO": 0.5,  # أقصى نسبة للقيم الفريدة لاعتبار العمود النصي فئوياً (قيم متكررة)
+    "CATEGORY_MIN_ROWS": 4,  # أقل عدد قيم غير فارغة لتحويل العمود إلى فئوي
+    
+    # إعدادات الكاش المشترك بين عمليات الخادم (عدة عمليات Streamlit على نفس الجهاز)
+    "SHARED_CACHE": True,
+    "SHARED_CACHE_DIR": "",  # فارغ = /dev/shm أو المجلد المؤقت للنظام
+    "SHARED_CACHE_KEEP_VERSIONS": 3,
+    
+    # تقسيم الملف على GitHub إلى ملف لكل محطة + manifest (اختياري)
+    # بدونه يُرفع الملف كاملاً مع كل حفظ، فحفظ محطات مختلفة يُرفع إلى GitHub واحداً بعد الآخر
+    "SHARDED_LAYOUT": False,
+    "SHARDS_DIR": "stations",  # مجلد ملفات المحطات داخل المستودع
+    
+    # مراقبة التحديثات على GitHub في الخلفية (بالثواني، 0 = تعطيل)
+    # تعمل بتوكن فقط: بدونه حد GitHub هو 60 طلباً في الساعة لكل عنوان IP (حتى ردود 304)
+    # وتستهلكه عمليتان أو ثلاث، فالتحديث يكون يدوياً من زر "تحديث الملف من GitHub"
+    "UPSTREAM_WATCH_SECONDS": 120,
+    
+    # تجهيز كاش الملف في الخلفية عند أول تشغيل للخادم (قبل دخول أول مستخدم)
+    "WARMUP_ON_BOOT": True,
+    
+    # تحليل الشيتات بالتوازي في عمليات منفصلة عند التحميل الكامل للملف
+    # مجموعة العمليات تُستخدم فقط للملفات الكبيرة (كل الشروط معاً): تشغيلها أول مرة يأخذ ثواني
+    # وتوزيع ملف صغير أبطأ من قراءته مباشرة (station.xlsx الحالي يُقرأ دائماً بالتتابع)
+    "PARALLEL_PARSE_MIN_SHEETS": 8,  # أقل عدد شيتات لاستخدام التحليل المتوازي (0 = تعطيل)
+    "PARALLEL_PARSE_MIN_BYTES": 1 << 20,  # أقل حجم للملف (1 MB)
+    "PARALLEL_PARSE_MIN_ROWS": 10000,  # أقل مجموع صفوف مسجل في الشيتات
+    "PARALLEL_PARSE_WORKERS": 0  # 0 = عدد أنوية المعالج
 }
 
 # ===============================
@@ -51,11 +126,15 @@ APP_CONFIG = {
 # ===============================
 USERS_FILE = "users.json"
 STATE_FILE = "state.json"
+SCHEMA_FILE = "schema.json"
+SHARDS_MANIFEST_FILE = "shards_manifest.json"  # آخر manifest تمت مزامنته مع GitHub
+REMOTE_BASE_FILE = "remote_base.json"  # sha الملف على GitHub الذي بُني عليه حفظ محلي لم يُرفع
 SESSION_DURATION = timedelta(minutes=APP_CONFIG["SESSION_DURATION_MINUTES"])
 MAX_ACTIVE_USERS = APP_CONFIG["MAX_ACTIVE_USERS"]
 
 # إنشاء رابط GitHub تلقائياً من الإعدادات
-GITHUB_EXCEL_URL = f"https://github.com/{APP_CONFIG['REPO_NAME'].split('/')[0]}/{APP_CONFIG['REPO_NAME'].split('/')[1]}/raw/{APP_CONFIG['BRANCH']}/{APP_CONFIG['FILE_PATH']}"
+GITHUB_RAW_BASE = f"https://github.com/{APP_CONFIG['REPO_NAME'].split('/')[0]}/{APP_CONFIG['REPO_NAME'].split('/')[1]}/raw/{APP_CONFIG['BRANCH']}"
+GITHUB_EXCEL_URL = f"{GITHUB_RAW_BASE}/{APP_CONFIG['FILE_PATH']}"
 
 # -------------------------------
 # 🧩 دوال مساعدة للملفات والحالة
@@ -236,29 +315,48 @@ def login_ui():
             logout_action()
         return True
 
+def _temp_path_for(path):
+    """ملف مؤقت بجوار الملف الهدف لاستبداله دفعة واحدة (os.replace)"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", suffix=os.path.splitext(path)[1], dir=directory)
+    os.close(fd)
+    return tmp_path
+
 # -------------------------------
 # 🔄 طرق جلب الملف من GitHub - معدلة لتعمل مثل CMMS
 # -------------------------------
+def install_downloaded_workbook(write, base_version):
+    """استبدال الملف المحلي بنسخة GitHub تحت workbook_lock (مثل المراقب)
+    لا يتم إذا كتب حفظٌ الملف أثناء التحميل أو كان حفظ مكتوب محلياً لم يكتمل رفعه"""
+    registry = get_sheet_locks()
+    with registry.workbook_lock:
+        if registry.push_pending() or get_workbook_version() != base_version:
+            st.warning("⚠ تم حفظ تعديل أثناء التحميل من GitHub فلم يُستبدل الملف المحلي. أعد التحديث بعد لحظات.")
+            return False
+        write()
+    # امسح الكاش
+    try:
+        st.cache_data.clear()
+    except:
+        pass
+    return True
+
 def fetch_from_github_requests():
     """تحميل بإستخدام رابط RAW (requests)"""
+    if APP_CONFIG["SHARDED_LAYOUT"]:
+        return fetch_shards_from_github()
     try:
-        response = requests.get(GITHUB_EXCEL_URL, stream=True, timeout=15)
+        base_version = get_workbook_version()
+        response = requests.get(GITHUB_EXCEL_URL, timeout=15)
         response.raise_for_status()
-        with open(APP_CONFIG["LOCAL_FILE"], "wb") as f:
-            shutil.copyfileobj(response.raw, f)
-        # امسح الكاش
-        try:
-            st.cache_data.clear()
-        except:
-            pass
-        return True
+        return install_downloaded_workbook(lambda: replace_local_with_remote(response.content), base_version)
     except Exception as e:
         st.error(f"⚠ فشل التحديث من GitHub: {e}")
         return False
 
 def fetch_from_github_api():
     """تحميل عبر GitHub API (باستخدام PyGithub token في secrets)"""
-    if not GITHUB_AVAILABLE:
+    if not GITHUB_AVAILABLE or APP_CONFIG["SHARDED_LAYOUT"]:
         return fetch_from_github_requests()
     
     try:
@@ -266,137 +364,1454 @@ def fetch_from_github_api():
         if not token:
             return fetch_from_github_requests()
         
-        g = Github(token)
+        base_version = get_workbook_version()
+        g = github_client(token)
         repo = g.get_repo(APP_CONFIG["REPO_NAME"])
         file_content = repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
         content = b64decode(file_content.content)
-        with open(APP_CONFIG["LOCAL_FILE"], "wb") as f:
-            f.write(content)
-        try:
-            st.cache_data.clear()
-        except:
-            pass
-        return True
+        return install_downloaded_workbook(lambda: replace_local_with_remote(content), base_version)
     except Exception as e:
         st.error(f"⚠ فشل تحميل الملف من GitHub: {e}")
         return False
 
 # -------------------------------
-# 📂 تحميل الشيتات (مخبأ) - معدل لقراءة جميع الشيتات
+# 🧬 استنتاج أنواع الأعمدة (Schema) وحفظه مع نسخة الملف
 # -------------------------------
 @st.cache_data(show_spinner=False)
+def _hash_file(path, mtime_ns, size):
+    """حساب بصمة محتوى الملف (المفتاح يشمل وقت التعديل والحجم)"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_workbook_version(path=None):
+    """نسخة ملف Excel المحلي = بصمة محتواه"""
+    path = path or APP_CONFIG["LOCAL_FILE"]
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+
+    # إذا حسبت عملية أخرى بصمة نفس الملف نستخدمها دون إعادة القراءة
+    pointer = _read_shared_pointer()
+    if pointer and pointer.get("path") == os.path.abspath(path) and \
+            pointer.get("mtime_ns") == stat.st_mtime_ns and pointer.get("size") == stat.st_size:
+        return pointer["version"]
+
+    version = _hash_file(path, stat.st_mtime_ns, stat.st_size)
+    _write_shared_pointer(path, stat, version)
+    return version
+
+def _value_kind(value):
+    """نوع قيمة خلية واحدة كما قرأها openpyxl"""
+    if isinstance(value, bool):
+        return "text"
+    if isinstance(value, numbers.Integral):
+        return "integer"
+    if isinstance(value, numbers.Real):
+        return "float"
+    if isinstance(value, datetime):
+        return "datetime"
+    if isinstance(value, str):
+        return "str"
+    return "text"
+
+def infer_column_kind(series):
+    """استنتاج نوع العمود من قيمه الفعلية بحيث يبقى التحويل بدون فقد"""
+    dtype = series.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return "category"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "datetime"
+    if pd.api.types.is_bool_dtype(dtype):
+        return "text"
+    if pd.api.types.is_integer_dtype(dtype):
+        return "integer"
+    if pd.api.types.is_float_dtype(dtype):
+        return "float" if series.notna().any() else "text"
+
+    values = series.dropna()
+    if values.empty:
+        return "text"
+    kinds = set(values.map(_value_kind).unique())
+    if kinds == {"integer"}:
+        return "integer"
+    if kinds <= {"integer", "float"}:
+        return "float"
+    if kinds == {"datetime"}:
+        return "datetime"
+    if kinds == {"str"}:
+        if len(values) >= APP_CONFIG["CATEGORY_MIN_ROWS"] and \
+                values.nunique() <= APP_CONFIG["CATEGORY_MAX_RATIO"] * len(values):
+            return "category"
+    return "text"
+
+def infer_workbook_schema(sheets):
+    """استنتاج أنواع الأعمدة لكل شيت"""
+    return {
+        name: {col: infer_column_kind(df[col]) for col in df.columns}
+        for name, df in sheets.items()
+    }
+
+def save_workbook_schema(version, schema):
+    """حفظ الـ schema مع بصمة نسخة الملف التي يخصها"""
+    try:
+        with open(SCHEMA_FILE, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "sheets": schema}, f, indent=4, ensure_ascii=False)
+    except Exception:
+        pass
+
+def load_workbook_schema(version, sheets):
+    """قراءة الـ schema المحفوظ لهذه النسخة أو استنتاجه من جديد وحفظه"""
+    try:
+        with open(SCHEMA_FILE, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("version") == version and set(stored.get("sheets", {})) == set(sheets):
+            return stored["sheets"]
+    except Exception:
+        pass
+    schema = infer_workbook_schema(sheets)
+    save_workbook_schema(version, schema)
+    return schema
+
+def apply_sheet_schema(df, sheet_schema):
+    """تحويل أعمدة الشيت إلى تخزين مضغوط حسب نوعها (فئوي/رقمي/تاريخ)"""
+    converted = {}
+    for col in df.columns:
+        kind = sheet_schema.get(col, "text")
+        series = df[col]
+        try:
+            if kind == "integer":
+                series = series.astype("Int64")
+            elif kind == "float":
+                series = pd.to_numeric(series).astype("float64")
+            elif kind == "datetime":
+                series = pd.to_datetime(series)
+            elif kind == "category":
+                series = series.astype("category")
+        except Exception:
+            # النوع المحفوظ لا يطابق القيم - نترك العمود كما هو
+            series = df[col].astype(object)
+        converted[col] = series
+    return pd.DataFrame(converted, index=df.index)
+
+def _parse_workers():
+    return APP_CONFIG["PARALLEL_PARSE_WORKERS"] or os.cpu_count() or 1
+
+@st.cache_resource(show_spinner=False)
+def get_parse_pool():
+    """عمليات تحليل الشيتات - مجموعة واحدة لكل عملية خادم
+    (spawn: العمليات الفرعية لا ترث الأقفال أو threads الخلفية من عملية Streamlit)"""
+    return ProcessPoolExecutor(max_workers=_parse_workers(), mp_context=multiprocessing.get_context("spawn"))
+
+def _assign_sheets(sizes, workers):
+    """توزيع الشيتات على العمليات حسب عدد صفوفها (الأكبر أولاً إلى الأقل حملاً)"""
+    groups = [[] for _ in range(workers)]
+    loads = [0] * workers
+    for name in sorted(sizes, key=sizes.get, reverse=True):
+        target = loads.index(min(loads))
+        groups[target].append(name)
+        loads[target] += sizes[name]
+    return [group for group in groups if group]
+
+def _read_sheets_parallel(content):
+    """قراءة الشيتات بالتوازي - كل عملية تقرأ الشيتات المخصصة لها فقط
+    يرجع None إذا كان الملف أصغر من أن يستحق التوزيع"""
+    min_sheets = APP_CONFIG["PARALLEL_PARSE_MIN_SHEETS"]
+    if not min_sheets or _parse_workers() < 2 or len(content) < APP_CONFIG["PARALLEL_PARSE_MIN_BYTES"]:
+        return None
+    sizes = sheet_workers.sheet_sizes(content)
+    if len(sizes) < min_sheets or sum(sizes.values()) < APP_CONFIG["PARALLEL_PARSE_MIN_ROWS"]:
+        return None
+
+    pool = get_parse_pool()
+    futures = [
+        pool.submit(sheet_workers.read_sheets, content, names)
+        for names in _assign_sheets(sizes, min(_parse_workers(), len(sizes)))
+    ]
+    parsed = {}
+    for future in futures:
+        parsed.update(future.result())
+    # نفس ترتيب الشيتات في الملف
+    return {name: parsed[name] for name in sizes}
+
+def _read_excel_raw(content):
+    """قراءة قيم جميع الشيتات كما هي في الملف (dtype=object) مع تنظيف أسماء الأعمدة"""
+    try:
+        sheets = _read_sheets_parallel(content)
+    except Exception as e:
+        if isinstance(e, BrokenProcessPool):
+            # عملية فرعية توقفت - مجموعة عمليات جديدة في المرة القادمة
+            get_parse_pool().shutdown(wait=False, cancel_futures=True)
+            get_parse_pool.clear()
+        # القراءة المتتابعة تعطي نفس النتيجة (أو نفس خطأ الملف)
+        sheets = None
+    if sheets is None:
+        sheets = pd.read_excel(io.BytesIO(content), sheet_name=None, dtype=object)
+    for name, df in sheets.items():
+        df.columns = df.columns.astype(str).str.strip()
+    return sheets
+
+def parse_sheets_bytes(content):
+    """تحليل ملف Excel إضافي (محطة أو أرشيف) بأنواع مستنتجة دون حفظ schema الملف الرئيسي"""
+    return {
+        name: apply_sheet_schema(df, get_sheet_schema(df))
+        for name, df in _read_excel_raw(content).items()
+    }
+
+def parse_date_column(series):
+    """تحويل عمود التاريخ (تواريخ Excel أو نصوص يوم/شهر/سنة) - القيم غير الصالحة NaT"""
+    return pd.to_datetime(series, errors="coerce", dayfirst=True, format="mixed")
+
+def parse_workbook_bytes(content):
+    """تحليل محتوى ملف Excel إلى شيتات بأنواعها المستنتجة - يرجع (النسخة، الشيتات)"""
+    version = hashlib.sha1(content).hexdigest()
+    sheets = _read_excel_raw(content)
+    if not sheets:
+        return version, None
+
+    schema = load_workbook_schema(version, sheets)
+    return version, {name: apply_sheet_schema(df, schema.get(name, {})) for name, df in sheets.items()}
+
+def read_workbook_typed(path):
+    """قراءة جميع الشيتات ثم تخزين كل عمود بنوعه المستنتج"""
+    with open(path, "rb") as f:
+        content = f.read()
+    return parse_workbook_bytes(content)[1]
+
+def get_sheet_schema(df):
+    """أنواع أعمدة شيت محمّل"""
+    return {col: infer_column_kind(df[col]) for col in df.columns}
+
+@st.cache_data(show_spinner=False)
+def load_stored_schema(version):
+    """الـ schema المحفوظ في schema.json إذا كان لهذه النسخة من الملف (وإلا None)"""
+    try:
+        with open(SCHEMA_FILE, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        if stored.get("version") == version:
+            return stored.get("sheets", {})
+    except Exception:
+        pass
+    return None
+
+def sheet_schema_for_edit(version, sheet_name, df):
+    """أنواع أعمدة الشيت من الـ schema المحفوظ (الاستنتاج من جديد فقط إذا لم يُحفظ لهذه النسخة)"""
+    stored = load_stored_schema(version)
+    if stored and sheet_name in stored:
+        return stored[sheet_name]
+    return get_sheet_schema(df)
+
+def editor_frame(df):
+    """نسخة المحرر: الأعمدة الفئوية كنص عادي حتى يمكن كتابة قيمة جديدة في الخلية"""
+    categorical = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+    return df.astype({col: object for col in categorical}) if categorical else df
+
+def build_column_config(df, sheet_schema):
+    """إعدادات أعمدة محرر البيانات حسب نوع كل عمود في الـ schema"""
+    config = {}
+    for col in df.columns:
+        kind = sheet_schema.get(col, "text")
+        help_text = f"يمكنك إدخال أي نوع من البيانات في عمود {col}"
+        if kind == "integer":
+            config[col] = st.column_config.NumberColumn(col, help=f"أدخل رقماً صحيحاً في عمود {col}", step=1, format="%d")
+        elif kind == "float":
+            config[col] = st.column_config.NumberColumn(col, help=f"أدخل رقماً في عمود {col}")
+        elif kind == "datetime":
+            config[col] = st.column_config.DatetimeColumn(col, help=f"أدخل تاريخاً في عمود {col}")
+        elif kind == "category":
+            # التخزين الفئوي لا يقيد التحرير - يمكن كتابة قيمة جديدة
+            config[col] = st.column_config.TextColumn(col, help=f"اكتب قيمة في عمود {col} (قيمة مسجلة أو جديدة)")
+        else:
+            config[col] = st.column_config.TextColumn(col, help=help_text)
+    return config
+
+def coerce_row_to_schema(row, sheet_schema):
+    """تحويل نصوص نموذج إضافة صف إلى أنواع أعمدة الشيت (القيمة غير القابلة للتحويل تبقى نصاً)"""
+    coerced = {}
+    for col, value in row.items():
+        if value is None or (isinstance(value, str) and not value.strip()):
+            coerced[col] = None
+            continue
+        kind = sheet_schema.get(col, "text")
+        try:
+            if kind == "integer":
+                coerced[col] = int(value)
+            elif kind == "float":
+                coerced[col] = float(value)
+            elif kind == "datetime":
+                coerced[col] = pd.to_datetime(value, dayfirst=True)
+            else:
+                coerced[col] = value
+        except (TypeError, ValueError):
+            coerced[col] = value
+    return coerced
+
+# -------------------------------
+# 🗃 كاش مشترك بين عمليات الخادم (ملفات Arrow في الذاكرة المشتركة)
+# -------------------------------
+def _shared_cache_dir():
+    """مجلد الكاش المشترك - كل نسخة من الملف في مجلد باسم بصمتها (مجلد لكل مستخدم نظام)"""
+    if APP_CONFIG["SHARED_CACHE_DIR"]:
+        return APP_CONFIG["SHARED_CACHE_DIR"]
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    owner = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "")
+    return os.path.join(base, f"luva_workbook_cache-{owner}")
+
+def _secure_cache_root():
+    """مجلد الكاش بعد التأكد أنه خاص بمستخدم الخادم (ليس رابطاً، مملوك لنا، بصلاحيات 0700)
+    يرجع None إذا أنشأه غيرنا أو كانت صلاحياته أوسع - الكاش يُعطل ولا يُقرأ منه شيء"""
+    if not APP_CONFIG["SHARED_CACHE"]:
+        return None
+    root = _shared_cache_dir()
+    try:
+        os.makedirs(root, mode=0o700, exist_ok=True)
+        info = os.lstat(root)
+    except OSError:
+        return None
+    if os.path.islink(root) or not os.path.isdir(root) or info.st_mode & 0o077:
+        return None
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        return None
+    return root
+
+def _read_shared_pointer():
+    """قراءة مؤشر آخر نسخة معروفة للملف المحلي"""
+    root = _secure_cache_root()
+    if root is None:
+        return None
+    try:
+        with open(os.path.join(root, "CURRENT.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return None
+
+def _write_shared_pointer(path, stat, version):
+    """تحديث المؤشر إذا لم يتغير الملف أثناء حساب بصمته"""
+    root = _secure_cache_root()
+    if root is None:
+        return
+    try:
+        current = os.stat(path)
+        if (current.st_mtime_ns, current.st_size) != (stat.st_mtime_ns, stat.st_size):
+            return
+        pointer = {
+            "path": os.path.abspath(path),
+            "version": version,
+            "mtime_ns": stat.st_mtime_ns,
+            "size": stat.st_size
+        }
+        tmp_path = os.path.join(root, f".CURRENT-{os.getpid()}.json")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(pointer, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(root, "CURRENT.json"))
+    except Exception:
+        pass
+
+def publish_shared_workbook(version, sheets):
+    """نشر نسخة محللة من الملف في الكاش المشترك لتستخدمها باقي العمليات بدون تحليل"""
+    root = _secure_cache_root()
+    if root is None or not sheets:
+        return False
+    target = os.path.join(root, version)
+    if os.path.isdir(target):
+        return True
+
+    staging = None
+    try:
+        staging = tempfile.mkdtemp(prefix=f".{version}-", dir=root)
+        manifest = []
+        for i, (name, df) in enumerate(sheets.items()):
+            entry = {"name": name, "file": f"sheet_{i}.arrow", "format": "arrow"}
+            # Arrow يعيد النصوص كـ str والفراغات كـ None - نسجل أعمدة object لاستعادتها كما هي
+            entry["object_columns"] = [pos for pos, dtype in enumerate(df.dtypes) if dtype == object]
+            try:
+                if not ARROW_AVAILABLE:
+                    raise TypeError("pyarrow غير متوفر")
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                with pa.OSFile(os.path.join(staging, entry["file"]), "wb") as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+            except Exception:
+                # أعمدة مختلطة الأنواع لا يمثلها Arrow - نحفظ الشيت كـ pickle
+                entry.update({"file": f"sheet_{i}.pkl", "format": "pickle"})
+                df.to_pickle(os.path.join(staging, entry["file"]))
+            manifest.append(entry)
+        with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "sheets": manifest}, f, ensure_ascii=False)
+
+        # إعادة التسمية دفعة واحدة: لا ترى العمليات الأخرى نسخة ناقصة
+        os.rename(staging, target)
+        staging = None
+        _prune_shared_cache(root)
+        return True
+    except Exception:
+        return os.path.isdir(target)
+    finally:
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
+
+def _prune_shared_cache(root):
+    """حذف النسخ القديمة من الكاش المشترك"""
+    versions = [
+        os.path.join(root, d) for d in os.listdir(root)
+        if not d.startswith(".") and os.path.isdir(os.path.join(root, d))
+    ]
+    versions.sort(key=os.path.getmtime, reverse=True)
+    for old in versions[APP_CONFIG["SHARED_CACHE_KEEP_VERSIONS"]:]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def _restore_object_columns(df, positions):
+    """إرجاع أعمدة object إلى شكلها بعد التحليل (قيم Python والفراغات NaN) بدل str/None من Arrow"""
+    for pos in positions:
+        column = df.iloc[:, pos]
+        df.isetitem(pos, column.astype(object).where(column.notna(), float("nan")))
+    return df
+
+def attach_shared_workbook(version):
+    """قراءة نسخة منشورة من الكاش المشترك
+    ملفات Arrow تُفتح كـ memory map: الأعمدة الرقمية بدون فراغات تبقى على صفحات الذاكرة المشتركة،
+    أما أعمدة النصوص فتُبنى في كل عملية (لا يمكن مشاركة كائنات Python بين العمليات)"""
+    root = _secure_cache_root()
+    if root is None:
+        return None
+    target = os.path.join(root, version)
+    try:
+        with open(os.path.join(target, "manifest.json"), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        sheets = {}
+        for entry in manifest["sheets"]:
+            path = os.path.join(target, entry["file"])
+            if entry["format"] == "arrow":
+                if not ARROW_AVAILABLE:
+                    return None
+                source = pa.memory_map(path, "r")
+                df = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+                sheets[entry["name"]] = _restore_object_columns(df, entry.get("object_columns", []))
+            else:
+                # pickle فقط من مجلد خاص بمستخدم الخادم (_secure_cache_root)
+                sheets[entry["name"]] = pd.read_pickle(path)
+        return sheets
+    except Exception:
+        return None
+
+# -------------------------------
+# 👀 مراقبة GitHub في الخلفية مع تبديل النسخة دفعة واحدة
+# -------------------------------
+class WorkbookBuffers:
+    """نسختان من الملف المحلل: النشطة التي تقرأها الجلسات والاحتياطية التي يجهزها المراقب"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = None  # (النسخة، الشيتات)
+        self._standby = None
+
+    def get(self, version):
+        with self._lock:
+            if self._active and self._active[0] == version:
+                return self._active[1]
+        return None
+
+    def current(self):
+        with self._lock:
+            return self._active[1] if self._active else None
+
+    def stage(self, version, sheets):
+        """تجهيز النسخة الجديدة دون أن تراها الجلسات"""
+        with self._lock:
+            self._standby = (version, sheets)
+
+    def swap(self):
+        """جعل النسخة المجهزة هي النشطة"""
+        with self._lock:
+            if self._standby:
+                self._active, self._standby = self._standby, None
+
+@st.cache_resource(show_spinner=False)
+def get_workbook_buffers():
+    """نسخة واحدة من الـ buffers لكل عملية خادم"""
+    return WorkbookBuffers()
+
+class UpstreamWatcher:
+    """خيط واحد لكل عملية يراقب آخر commit للملف على GitHub ويجهز النسخة الجديدة في الخلفية"""
+
+    def __init__(self, buffers, locks, token, interval):
+        self.buffers = buffers
+        self.locks = locks
+        self.token = token
+        self.interval = interval
+        self._etag = None
+        self._marker = None
+        self._started = False
+        self._thread = threading.Thread(target=self._run, name="upstream-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.check_once()
+            except Exception as e:
+                logger.warning("upstream watcher: poll failed: %s", e)
+            time.sleep(self.interval)
+
+    def _upstream_marker(self):
+        """آخر commit يخص الملف (طلب صغير، و304 إذا لم يتغير شيء)"""
+        path = APP_CONFIG["SHARDS_DIR"] if APP_CONFIG["SHARDED_LAYOUT"] else APP_CONFIG["FILE_PATH"]
+        headers = {"Accept": "application/vnd.github+json"}
+        if self.token:
+            headers["Authorization"] = f"Bearer {self.token}"
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        response = requests.get(
+            f"https://api.github.com/repos/{APP_CONFIG['REPO_NAME']}/commits",
+            params={"path": path, "sha": APP_CONFIG["BRANCH"], "per_page": 1},
+            headers=headers,
+            timeout=15
+        )
+        if response.status_code == 304:
+            return self._marker
+        response.raise_for_status()
+        self._etag = response.headers.get("ETag")
+        commits = response.json()
+        return commits[0]["sha"] if commits else None
+
+    def check_once(self):
+        """فحص واحد - يرجع True إذا تم تبديل النسخة"""
+        base_version = get_workbook_version()
+        marker = self._upstream_marker()
+        if not self._started:
+            # أول فحص يسجل الحالة فقط: لا نستبدل ملفاً محلياً لم يطلب أحد تحديثه
+            self._started = True
+            self._marker = marker
+            return False
+        if marker == self._marker:
+            return False
+
+        manifest = None
+        if APP_CONFIG["SHARDED_LAYOUT"]:
+            current = self.buffers.current()
+            if current is None and os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+                current = read_workbook_typed(APP_CONFIG["LOCAL_FILE"])
+            sheets, manifest = download_changed_shards(current or {}, ref=marker)
+            if sheets is None:
+                save_local_shard_manifest(manifest)
+                self._marker = marker
+                return False
+            buffer = io.BytesIO()
+            _write_workbook(buffer, sheets)
+            content = buffer.getvalue()
+        else:
+            # التحميل بالـ commit نفسه (وليس الفرع) حتى لا نحصل على نسخة قديمة من الكاش
+            content = _download_repo_file(APP_CONFIG["FILE_PATH"], ref=marker)
+
+        version = hashlib.sha1(content).hexdigest()
+        if version == base_version:
+            # نفس الملف المحلي (مثلاً الحفظ الذي رفعناه نحن)
+            self._marker = marker
+            return False
+
+        # التحليل الكامل في الـ buffer الاحتياطي بينما تقرأ الجلسات النسخة القديمة
+        sheets = attach_shared_workbook(version)
+        if sheets is None:
+            version, sheets = parse_workbook_bytes(content)
+            publish_shared_workbook(version, sheets)
+
+        # الاستبدال تحت نفس قفل الحفظ: إذا كتب حفظٌ الملف المحلي أثناء التحميل لا نستبدله،
+        # ولا نستبدله ما دام حفظ مكتوب محلياً لم يكتمل رفعه (الفحص القادم يرى نتيجة الرفع)
+        with self.locks.workbook_lock:
+            if self.locks.push_pending() or get_workbook_version() != base_version:
+                return False
+            self.buffers.stage(version, sheets)
+            if manifest is not None:
+                replace_local_file(content)
+                save_local_shard_manifest(manifest)
+            else:
+                replace_local_with_remote(content)
+            _write_shared_pointer(APP_CONFIG["LOCAL_FILE"], os.stat(APP_CONFIG["LOCAL_FILE"]), version)
+            self.buffers.swap()
+        self._marker = marker
+        return True
+
+@st.cache_resource(show_spinner=False)
+def start_upstream_watcher():
+    """تشغيل المراقب مرة واحدة لكل عملية خادم"""
+    interval = APP_CONFIG["UPSTREAM_WATCH_SECONDS"]
+    if not interval or interval <= 0:
+        return None
+    try:
+        token = st.secrets.get("github", {}).get("token", None)
+    except Exception:
+        token = None
+    if not token:
+        logger.warning("upstream watcher disabled: no GitHub token configured")
+        return None
+    watcher = UpstreamWatcher(get_workbook_buffers(), get_sheet_locks(), token, interval)
+    watcher.start()
+    return watcher
+
+@st.cache_resource(show_spinner=False)
+def start_boot_warmup():
+    """تحليل الملف المحلي في الخلفية مرة واحدة لكل عملية حتى يجده أول مستخدم جاهزاً"""
+    if not APP_CONFIG["WARMUP_ON_BOOT"]:
+        return None
+
+    def warmup():
+        try:
+            version = get_workbook_version()
+            buffers = get_workbook_buffers()
+            if version is None or buffers.get(version) is not None:
+                return
+            sheets = attach_shared_workbook(version)
+            if sheets is None:
+                with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+                    version, sheets = parse_workbook_bytes(f.read())
+                publish_shared_workbook(version, sheets)
+            if buffers.current() is None:
+                buffers.stage(version, sheets)
+                buffers.swap()
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=warmup, name="workbook-warmup", daemon=True)
+    thread.start()
+    return thread
+
+# -------------------------------
+# 📂 تحميل الشيتات (مخبأ) - معدل لقراءة جميع الشيتات
+# -------------------------------
+def _enable_copy_on_write():
+    """تفعيل Copy-on-Write في pandas 2 (مفعل دائماً في pandas 3)
+    أي تعديل على داتافرام مشترك ينسخه أولاً، فلا يتأثر الكاش ولا الجلسات الأخرى"""
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+
+# st.cache_resource يرجع نفس الكائن لكل الجلسات بدون نسخ (st.cache_data ينسخ الملف كاملاً في كل استدعاء)
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _load_workbook_version(version):
+    """تحميل نسخة محددة من الملف: جهزها المراقب أو من الكاش المشترك وإلا تحليلها ثم نشرها
+    يرجع قاموساً للقراءة فقط من داتافرامات مشتركة بين كل الجلسات"""
+    _enable_copy_on_write()
+    sheets = get_workbook_buffers().get(version)
+    if sheets is None:
+        sheets = attach_shared_workbook(version)
+    if sheets is None:
+        with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+            content = f.read()
+        parsed_version, sheets = parse_workbook_bytes(content)
+        publish_shared_workbook(parsed_version, sheets)
+    return MappingProxyType(sheets) if sheets is not None else None
+
 def load_all_sheets():
     """تحميل جميع الشيتات من ملف Excel"""
-    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+    version = get_workbook_version()
+    if version is None:
         return None
     
     try:
-        # قراءة جميع الشيتات
-        sheets = pd.read_excel(APP_CONFIG["LOCAL_FILE"], sheet_name=None)
-        
-        if not sheets:
-            return None
-        
-        # تنظيف أسماء الأعمدة لكل شيت
-        for name, df in sheets.items():
-            df.columns = df.columns.astype(str).str.strip()
-        
-        return sheets
+        return _load_workbook_version(version)
     except Exception as e:
         return None
 
-# نسخة مع dtype=object لواجهة التحرير
-@st.cache_data(show_spinner=False)
+# واجهة التحرير تستخدم نفس الداتافرامات المشتركة: محرر البيانات يرجع داتافرام جديداً
+# للشيت المعدل فقط، و Copy-on-Write ينسخ أي شيت آخر عند أول تعديل عليه فقط
 def load_sheets_for_edit():
     """تحميل جميع الشيتات للتحرير"""
-    if not os.path.exists(APP_CONFIG["LOCAL_FILE"]):
-        return None
-    
+    return load_all_sheets()
+
+# -------------------------------
+# 🧩 تقسيم الملف على GitHub: ملف لكل محطة + manifest
+# -------------------------------
+def sheet_digest(df):
+    """بصمة محتوى الشيت (لا تتأثر بطريقة تخزين الأعمدة)"""
+    digest = hashlib.sha1("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    for col in df.columns:
+        digest.update(pd.util.hash_pandas_object(df[col].astype(object), index=False).values.tobytes())
+    return digest.hexdigest()
+
+def _shard_file_name(sheet_name):
+    """اسم ملف المحطة في المستودع (آمن للمسارات ولا يتكرر لأسماء متشابهة)"""
+    slug = re.sub(r"[^\w\-.]+", "_", sheet_name.strip()).strip("_") or "sheet"
+    return f"{slug}_{hashlib.sha1(sheet_name.encode('utf-8')).hexdigest()[:8]}.xlsx"
+
+def _sheet_to_xlsx_bytes(name, df):
+    """ملف Excel يحتوي شيت محطة واحدة"""
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        try:
+            df.to_excel(writer, sheet_name=name, index=False)
+        except Exception:
+            df.astype(object).to_excel(writer, sheet_name=name, index=False)
+    return buffer.getvalue()
+
+def load_local_shard_manifest():
+    """آخر manifest تمت مزامنته محلياً"""
     try:
-        # قراءة جميع الشيتات مع dtype=object للحفاظ على تنسيق البيانات
-        sheets = pd.read_excel(APP_CONFIG["LOCAL_FILE"], sheet_name=None, dtype=object)
-        
-        if not sheets:
-            return None
-        
-        # تنظيف أسماء الأعمدة لكل شيت
-        for name, df in sheets.items():
-            df.columns = df.columns.astype(str).str.strip()
-        
-        return sheets
+        with open(SHARDS_MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {"sheets": []}
+
+def save_local_shard_manifest(manifest):
+    with open(SHARDS_MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4, ensure_ascii=False)
+
+def _download_repo_file(path, ref=None):
+    """تحميل ملف من المستودع (GitHub API بالتوكن إن وجد وإلا رابط RAW) - ref = فرع أو commit"""
+    ref = ref or APP_CONFIG["BRANCH"]
+    token = st.secrets.get("github", {}).get("token", None)
+    if token and GITHUB_AVAILABLE:
+        repo = github_client(token).get_repo(APP_CONFIG["REPO_NAME"])
+        return repo.get_contents(path, ref=ref).decoded_content
+    response = requests.get(f"https://github.com/{APP_CONFIG['REPO_NAME']}/raw/{ref}/{quote(path)}", timeout=15)
+    response.raise_for_status()
+    return response.content
+
+def push_changed_shards(repo, sheets_dict, commit_message):
+    """رفع ملفات المحطات التي تغيرت فقط ثم تحديث الـ manifest - يرجع عدد الملفات المرفوعة"""
+    branch = APP_CONFIG["BRANCH"]
+    manifest_path = f"{APP_CONFIG['SHARDS_DIR']}/manifest.json"
+    synced = {e["name"]: e for e in load_local_shard_manifest().get("sheets", [])}
+
+    # الـ manifest الحالي على GitHub (قد يكون مستخدم آخر رفع محطات أخرى)
+    try:
+        remote_file = repo.get_contents(manifest_path, ref=branch)
+        remote_manifest_sha = remote_file.sha
+        remote = {e["name"]: e for e in json.loads(remote_file.decoded_content).get("sheets", [])}
     except Exception as e:
-        return None
+        # 404 فقط يعني أنه لا يوجد manifest بعد - أي خطأ آخر يوقف الرفع قبل رفع أي ملف
+        if not _is_missing_remote_file(e):
+            raise
+        remote_manifest_sha = None
+        remote = {}
+
+    entries = []
+    pushed = 0
+    for name, df in sheets_dict.items():
+        digest = sheet_digest(df)
+        if name in synced and synced[name]["digest"] == digest:
+            # لم تتغير عندنا - نحتفظ بما على GitHub
+            entries.append(remote.get(name, synced[name]))
+            continue
+        entry = {"name": name, "file": _shard_file_name(name), "digest": digest}
+        path = f"{APP_CONFIG['SHARDS_DIR']}/{entry['file']}"
+        content = _sheet_to_xlsx_bytes(name, df)
+        # الرفع فوق ملف المحطة الذي بُنيت عليه النسخة المحلية (409 إذا غيره غيرنا)
+        # والـ sha من GitHub فقط لمحطات لم نزامنها بعد (أول رفع بهذا التقسيم)
+        base_sha = synced[name].get("sha") if name in synced else remote.get(name, {}).get("sha")
+        if base_sha:
+            result = repo.update_file(path=path, message=commit_message, content=content, sha=base_sha, branch=branch)
+        else:
+            result = repo.create_file(path=path, message=commit_message, content=content, branch=branch)
+        entry["sha"] = result["content"].sha
+        entries.append(entry)
+        pushed += 1
+
+    # محطات حُذفت عندنا
+    for name, entry in synced.items():
+        if name not in sheets_dict and name in remote:
+            repo.delete_file(path=f"{APP_CONFIG['SHARDS_DIR']}/{remote[name]['file']}", message=commit_message, sha=remote[name]["sha"], branch=branch)
+            pushed += 1
+
+    # محطات أضافها غيرنا ولم نرها بعد
+    entries.extend(e for name, e in remote.items() if name not in sheets_dict and name not in synced)
+
+    manifest = {"sheets": entries}
+    if pushed or remote_manifest_sha is None:
+        manifest_content = json.dumps(manifest, indent=4, ensure_ascii=False)
+        if remote_manifest_sha:
+            repo.update_file(path=manifest_path, message=commit_message, content=manifest_content, sha=remote_manifest_sha, branch=branch)
+        else:
+            repo.create_file(path=manifest_path, message=commit_message, content=manifest_content, branch=branch)
+    save_local_shard_manifest(manifest)
+    return pushed
+
+def push_sheet_shard(repo, sheets_dict, sheet_name, commit_message):
+    """رفع ملف محطة واحدة ثم تحديث مدخلها فقط في الـ manifest - يرجع عدد الملفات المرفوعة
+    رفع ملف المحطة لا ينتظر حفظ المحطات الأخرى، والقفل المشترك يغطي تحديث الـ manifest فقط"""
+    branch = APP_CONFIG["BRANCH"]
+    manifest_path = f"{APP_CONFIG['SHARDS_DIR']}/manifest.json"
+    manifest_lock = get_sheet_locks().manifest_lock
+    synced = load_local_shard_manifest().get("sheets", [])
+    if not synced:
+        # أول رفع بهذا التقسيم: ننشئ كل ملفات المحطات والـ manifest
+        with manifest_lock:
+            return push_changed_shards(repo, sheets_dict, commit_message)
+
+    df = sheets_dict[sheet_name]
+    entry = {"name": sheet_name, "file": _shard_file_name(sheet_name), "digest": sheet_digest(df)}
+    path = f"{APP_CONFIG['SHARDS_DIR']}/{entry['file']}"
+    content = _sheet_to_xlsx_bytes(sheet_name, df)
+    # الرفع فوق ملف المحطة الذي بُنيت عليه النسخة المحلية: إذا غيره غيرنا يرفض GitHub الرفع (409)
+    base_sha = next((e.get("sha") for e in synced if e["name"] == sheet_name), None)
+    if base_sha:
+        result = repo.update_file(path=path, message=commit_message, content=content, sha=base_sha, branch=branch)
+    else:
+        result = repo.create_file(path=path, message=commit_message, content=content, branch=branch)
+    entry["sha"] = result["content"].sha
+
+    def with_entry(entries):
+        names = [e["name"] for e in entries]
+        entries = list(entries)
+        if sheet_name in names:
+            entries[names.index(sheet_name)] = entry
+        else:
+            entries.append(entry)
+        return entries
+
+    with manifest_lock:
+        # نقرأ الـ manifest من جديد: محطات أخرى ربما رُفعت أثناء رفع هذه المحطة
+        # تحديثه دمج لمدخل واحد، فإذا سبقتنا عملية أخرى (409) نعيد القراءة والدمج
+        for attempt in range(3):
+            try:
+                remote_file = repo.get_contents(manifest_path, ref=branch)
+            except Exception as e:
+                if not _is_missing_remote_file(e):
+                    raise
+                remote_file = None
+            remote = json.loads(remote_file.decoded_content).get("sheets", []) if remote_file is not None else synced
+            manifest_content = json.dumps({"sheets": with_entry(remote)}, indent=4, ensure_ascii=False)
+            try:
+                if remote_file is not None:
+                    repo.update_file(path=manifest_path, message=commit_message, content=manifest_content, sha=remote_file.sha, branch=branch)
+                else:
+                    repo.create_file(path=manifest_path, message=commit_message, content=manifest_content, branch=branch)
+                break
+            except Exception as e:
+                if not _is_remote_conflict(e) or attempt == 2:
+                    raise
+        save_local_shard_manifest({"sheets": with_entry(load_local_shard_manifest().get("sheets", []))})
+    return 1
+
+def download_changed_shards(current, ref=None):
+    """تحميل ملفات المحطات التي تغيرت فقط وتجميعها مع الشيتات الحالية
+    يرجع (الشيتات المجمعة، الـ manifest) - الشيتات None إذا لم تتغير أي محطة"""
+    remote = json.loads(_download_repo_file(f"{APP_CONFIG['SHARDS_DIR']}/manifest.json", ref))
+    synced = {e["name"]: e for e in load_local_shard_manifest().get("sheets", [])}
+
+    sheets = {}
+    changed = [e["name"] for e in remote.get("sheets", [])] != list(current)
+    for entry in remote.get("sheets", []):
+        name = entry["name"]
+        if name in current and synced.get(name, {}).get("digest") == entry["digest"]:
+            sheets[name] = current[name]
+            continue
+        shard = parse_sheets_bytes(_download_repo_file(f"{APP_CONFIG['SHARDS_DIR']}/{entry['file']}", ref))
+        sheets[name] = next(iter(shard.values()))
+        changed = True
+    return (sheets if changed else None), remote
+
+def fetch_shards_from_github():
+    """تحميل ملفات المحطات التي تغيرت فقط ثم تجميعها في ملف Excel المحلي"""
+    try:
+        base_version = get_workbook_version()
+        sheets, remote = download_changed_shards(load_all_sheets() or {})
+
+        def write():
+            if sheets is not None:
+                write_workbook_file(sheets)
+            save_local_shard_manifest(remote)
+
+        return install_downloaded_workbook(write, base_version)
+    except Exception as e:
+        st.error(f"⚠ فشل تحميل ملفات المحطات من GitHub: {e}")
+        return False
 
 # -------------------------------
 # 🔁 حفظ محلي + رفع على GitHub + مسح الكاش + إعادة تحميل - مثل CMMS
 # -------------------------------
-def save_local_excel_and_push(sheets_dict, commit_message="Update from Streamlit"):
-    """دالة محسنة للحفظ التلقائي المحلي والرفع إلى GitHub"""
-    # احفظ محلياً
+def _write_workbook(target, sheets_dict):
+    """كتابة جميع الشيتات في ملف أو buffer"""
+    with pd.ExcelWriter(target, engine="openpyxl") as writer:
+        for name, sh in sheets_dict.items():
+            try:
+                sh.to_excel(writer, sheet_name=name, index=False)
+            except Exception:
+                sh.astype(object).to_excel(writer, sheet_name=name, index=False)
+
+def write_workbook_file(sheets_dict, path=None):
+    """كتابة جميع الشيتات في ملف Excel المحلي (ملف مؤقت ثم استبدال دفعة واحدة حتى لا تقرأ عملية أخرى ملفاً ناقصاً)
+    يرجع محتوى الملف الذي كُتب"""
+    buffer = io.BytesIO()
+    _write_workbook(buffer, sheets_dict)
+    content = buffer.getvalue()
+    replace_local_file(content, path)
+    return content
+
+def read_local_workbook_bytes():
+    """محتوى ملف Excel المحلي كما هو (لزر التحميل)"""
+    with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
+        return f.read()
+
+def replace_local_file(content, path=None):
+    """استبدال ملف Excel المحلي بمحتوى جاهز دفعة واحدة"""
+    path = path or APP_CONFIG["LOCAL_FILE"]
+    tmp_path = _temp_path_for(path)
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+def git_blob_sha(content):
+    """sha الملف كما يحسبه GitHub (git blob) - هو sha المطلوب في update_file"""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+def save_remote_base(version, sha):
+    """تسجيل sha الملف على GitHub الذي بُنيت عليه نسخة الملف المحلي"""
+    try:
+        with open(REMOTE_BASE_FILE, "w", encoding="utf-8") as f:
+            json.dump({"version": version, "sha": sha}, f)
+    except Exception:
+        pass
+
+def remote_base_sha(content):
+    """sha الملف على GitHub الذي بُني عليه هذا المحتوى المحلي (يُرفع فوقه فقط)
+    حفظ لم يكتمل رفعه يبقى مبنياً على sha مسجل، وإلا فالملف المحلي نسخة من GitHub كما هي"""
     try:
-        with pd.ExcelWriter(APP_CONFIG["LOCAL_FILE"], engine="openpyxl") as writer:
-            for name, sh in sheets_dict.items():
-                try:
-                    sh.to_excel(writer, sheet_name=name, index=False)
-                except Exception:
-                    sh.astype(object).to_excel(writer, sheet_name=name, index=False)
+        with open(REMOTE_BASE_FILE, "r", encoding="utf-8") as f:
+            base = json.load(f)
+    except Exception:
+        base = {}
+    if base.get("version") == hashlib.sha1(content).hexdigest():
+        return base.get("sha")
+    return git_blob_sha(content)
+
+def replace_local_with_remote(content):
+    """استبدال الملف المحلي بنسخة GitHub كما هي (وهي أساس الرفع القادم)"""
+    replace_local_file(content)
+    save_remote_base(hashlib.sha1(content).hexdigest(), git_blob_sha(content))
+
+def write_local_workbook(sheets_dict):
+    """الحفظ المحلي + حفظ أنواع الأعمدة + مسح الكاش - يرجع المحتوى المكتوب (للرفع) أو None عند الفشل"""
+    try:
+        content = write_workbook_file(sheets_dict)
     except Exception as e:
         st.error(f"⚠ خطأ أثناء الحفظ المحلي: {e}")
         return None
 
+    # حفظ أنواع الأعمدة مع النسخة الجديدة من الملف
+    save_workbook_schema(get_workbook_version(), infer_workbook_schema(sheets_dict))
+
     # امسح الكاش
     try:
         st.cache_data.clear()
     except:
         pass
+    return content
 
+def push_workbook_to_github(sheets_dict, commit_message, content, sheet_name=None, base_sha=None):
+    """رفع محتوى الملف الذي كتبه هذا الحفظ (أو ملفات المحطات المعدلة) إلى GitHub
+    لا نعيد قراءة الملف المحلي: قد يكون المراقب استبدله بنسخة GitHub بين الكتابة والرفع
+    sheet_name: في وضع التقسيم يُرفع ملف هذه المحطة وحدها
+    base_sha: sha الملف على GitHub الذي بُني عليه الحفظ - إذا تغير الملف هناك يُرفض الرفع (409)
+    بدل أن يلغي تعديل مستخدم في عملية أو خادم آخر"""
     # حاول الرفع عبر PyGithub token في secrets
     token = st.secrets.get("github", {}).get("token", None)
     if not token:
         st.warning("⚠ لم يتم العثور على GitHub token. سيتم الحفظ محلياً فقط.")
-        return load_sheets_for_edit()
+        return True
 
     if not GITHUB_AVAILABLE:
         st.warning("⚠ PyGithub غير متوفر. سيتم الحفظ محلياً فقط.")
-        return load_sheets_for_edit()
+        return True
 
     try:
-        g = Github(token)
+        g = github_client(token)
         repo = g.get_repo(APP_CONFIG["REPO_NAME"])
-        with open(APP_CONFIG["LOCAL_FILE"], "rb") as f:
-            content = f.read()
 
+        # في وضع التقسيم نرفع ملفات المحطات المعدلة فقط
+        if APP_CONFIG["SHARDED_LAYOUT"]:
+            if sheet_name is not None:
+                pushed = push_sheet_shard(repo, sheets_dict, sheet_name, commit_message)
+            else:
+                with get_sheet_locks().manifest_lock:
+                    pushed = push_changed_shards(repo, sheets_dict, commit_message)
+            st.success(f"✅ تم رفع {pushed} ملف محطة معدل إلى GitHub: {commit_message}")
+            return True
+
+        version = hashlib.sha1(content).hexdigest()
         try:
-            contents = repo.get_contents(APP_CONFIG["FILE_PATH"], ref=APP_CONFIG["BRANCH"])
-            result = repo.update_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, sha=contents.sha, branch=APP_CONFIG["BRANCH"])
-            st.success(f"✅ تم الحفظ والرفع إلى GitHub بنجاح: {commit_message}")
-            return load_sheets_for_edit()
-        except Exception as e:
-            # حاول رفع كملف جديد أو إنشاء
-            try:
+            if base_sha:
+                result = repo.update_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, sha=base_sha, branch=APP_CONFIG["BRANCH"])
+            else:
+                # لا يوجد ملف محلي سابق: أول رفع للملف
                 result = repo.create_file(path=APP_CONFIG["FILE_PATH"], message=commit_message, content=content, branch=APP_CONFIG["BRANCH"])
-                st.success(f"✅ تم إنشاء ملف جديد على GitHub: {commit_message}")
-                return load_sheets_for_edit()
-            except Exception as create_error:
-                st.error(f"❌ فشل إنشاء ملف جديد على GitHub: {create_error}")
-                return None
+        except Exception:
+            # الحفظ المحلي لم يُرفع: يبقى مبنياً على نفس النسخة من GitHub
+            save_remote_base(version, base_sha)
+            raise
+        save_remote_base(version, result["content"].sha)
+        st.success(f"✅ تم الحفظ والرفع إلى GitHub بنجاح: {commit_message}")
+        return True
 
     except Exception as e:
+        if _is_remote_conflict(e):
+            st.error("⛔ تم تحديث الملف على GitHub من مكان آخر بعد آخر تحميل هنا، فلم يُرفع هذا الحفظ حتى لا يلغي ذلك التعديل. "
+                     "اضغط '🔄 تحديث الملف من GitHub' ثم أعد التعديل.")
+            return False
         st.error(f"❌ فشل الرفع إلى GitHub: {e}")
-        return None
+        return False
 
-def auto_save_to_github(sheets_dict, operation_description):
-    """دالة الحفظ التلقائي المحسنة"""
+def _commit_message(operation_description):
     username = st.session_state.get("username", "unknown")
-    commit_message = f"{operation_description} by {username} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    
-    result = save_local_excel_and_push(sheets_dict, commit_message)
-    if result is not None:
-        st.success("✅ تم حفظ التغييرات تلقائياً في GitHub")
-        return result
-    else:
-        st.error("❌ فشل الحفظ التلقائي")
-        return sheets_dict
+    return f"{operation_description} by {username} at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+
+# -------------------------------
+# ✅ التحقق من البيانات قبل الحفظ (على الصفوف المعدلة فقط)
+# -------------------------------
+VALIDATION_ERROR_COLUMNS = ["الصف", "العمود", "المشكلة", "القيمة"]
+
+def changed_rows_mask(original_df, new_df):
+    """الصفوف الجديدة أو التي تغيرت قيمها مقارنة بالشيت الأصلي
+    المقارنة بالمحتوى (بصمة لكل صف) وليس برقم الصف: حذف صف أو إعادة الترقيم لا يجعل باقي الصفوف معدلة"""
+    columns = list(new_df.columns)
+    new_hashes = pd.util.hash_pandas_object(new_df.astype(object), index=False)
+    old_hashes = pd.util.hash_pandas_object(
+        original_df.reindex(columns=columns).astype(object), index=False
+    )
+    return ~new_hashes.isin(set(old_hashes)).to_numpy()
+
+def _blank_mask(series):
+    return series.isna().to_numpy() | series.astype("string").str.strip().eq("").fillna(True).to_numpy()
+
+def _validation_errors(rows, mask, column, issue):
+    return pd.DataFrame({
+        "الصف": rows.index[mask],
+        "العمود": column,
+        "المشكلة": issue,
+        "القيمة": rows[column][mask].astype("string").fillna("").to_numpy()
+    }, columns=VALIDATION_ERROR_COLUMNS)
+
+def validate_sheet_changes(original_df, new_df, sheet_schema=None):
+    """فحص الصفوف المعدلة: الحقول الإلزامية، صلاحية التواريخ، ومطابقة نوع العمود في الـ schema
+    يرجع جدول أخطاء لكل صف (فارغ إذا لم توجد أخطاء)"""
+    rows = new_df[changed_rows_mask(original_df, new_df)]
+    if rows.empty:
+        return pd.DataFrame(columns=VALIDATION_ERROR_COLUMNS)
+
+    schema = sheet_schema or get_sheet_schema(original_df)
+    errors = []
+    for col in rows.columns:
+        blank = _blank_mask(rows[col])
+        if col in APP_CONFIG["MANDATORY_COLUMNS"] and blank.any():
+            errors.append(_validation_errors(rows, blank, col, "حقل إلزامي فارغ"))
+
+        kind = schema.get(col, "text")
+        values = rows[col].astype(object)
+        if kind == "datetime" or col == APP_CONFIG["DATE_COLUMN"]:
+            bad = ~blank & parse_date_column(values).isna().to_numpy()
+            if bad.any():
+                errors.append(_validation_errors(rows, bad, col, "تاريخ غير صالح"))
+        elif kind in ("integer", "float"):
+            numeric = pd.to_numeric(values, errors="coerce")
+            bad = ~blank & numeric.isna().to_numpy()
+            if bad.any():
+                errors.append(_validation_errors(rows, bad, col, "قيمة غير رقمية"))
+            if kind == "integer":
+                fractional = ~blank & ~bad & (numeric.fillna(0) % 1 != 0).to_numpy()
+                if fractional.any():
+                    errors.append(_validation_errors(rows, fractional, col, "يجب أن تكون رقماً صحيحاً"))
+
+    if not errors:
+        return pd.DataFrame(columns=VALIDATION_ERROR_COLUMNS)
+    return pd.concat(errors, ignore_index=True).sort_values(["الصف", "العمود"], kind="stable", ignore_index=True)
+
+# -------------------------------
+# 🔒 أقفال ونسخ لكل شيت (حفظ محطات مختلفة بالتوازي دون أن يلغي أحد تعديل الآخر)
+# -------------------------------
+class SheetLocks:
+    """قفل ورقم نسخة لكل شيت داخل عملية الخادم"""
+
+    def __init__(self):
+        self._guard = threading.Lock()
+        self._locks = {}
+        self._versions = {}
+        self._digests = {}
+        self._workbook_version = None
+        # كتابة الملف المحلي ورفعه عمليتان على ملف واحد - قفلان قصيران مشتركان
+        self.workbook_lock = threading.Lock()
+        self.push_lock = threading.Lock()
+        # في وضع التقسيم: تحديث manifest المحطات فقط (ملفات المحطات تُرفع بالتوازي)
+        self.manifest_lock = threading.Lock()
+        # حفظ كُتب محلياً ولم يكتمل رفعه: لا يُستبدل الملف المحلي بنسخة GitHub خلاله
+        self._pending_pushes = 0
+
+    def lock(self, sheet_name):
+        with self._guard:
+            return self._locks.setdefault(sheet_name, threading.Lock())
+
+    def version(self, sheet_name):
+        with self._guard:
+            return self._versions.get(sheet_name, 0)
+
+    @contextmanager
+    def pending_push(self):
+        """من قبل الكتابة المحلية حتى انتهاء الرفع"""
+        with self._guard:
+            self._pending_pushes += 1
+        try:
+            yield
+        finally:
+            with self._guard:
+                self._pending_pushes -= 1
+
+    def push_pending(self):
+        with self._guard:
+            return self._pending_pushes > 0
+
+    def sync(self, workbook_version, sheets):
+        """زيادة رقم نسخة كل شيت تغير محتواه في نسخة جديدة من الملف (حفظ أو تحديث من GitHub)"""
+        with self._guard:
+            if workbook_version is None or workbook_version == self._workbook_version:
+                return
+            for name, df in (sheets or {}).items():
+                digest = sheet_digest(df)
+                if self._digests.get(name) != digest:
+                    self._digests[name] = digest
+                    self._versions[name] = self._versions.get(name, 0) + 1
+            self._workbook_version = workbook_version
+
+@st.cache_resource(show_spinner=False)
+def get_sheet_locks():
+    """سجل أقفال واحد لكل عملية خادم"""
+    return SheetLocks()
+
+def sync_sheet_versions(registry):
+    """مزامنة أرقام نسخ الشيتات مع النسخة الحالية من الملف - يرجع شيتات هذه النسخة
+    البصمات تُحسب من الشيتات المحملة لنفس رقم النسخة: شيتات حملتها جلسة قبل حفظ آخر
+    لا تُسجل تحت رقم النسخة الجديدة (وإلا يبدو الشيت المحفوظ معدلاً من مستخدم آخر)"""
+    version = get_workbook_version()
+    if version is None:
+        return None
+    try:
+        sheets = _load_workbook_version(version)
+    except Exception:
+        return None
+    registry.sync(version, sheets)
+    return sheets
+
+def current_sheet_version(sheet_name):
+    """رقم نسخة الشيت في النسخة الحالية من الملف"""
+    registry = get_sheet_locks()
+    sync_sheet_versions(registry)
+    return registry.version(sheet_name)
+
+def save_sheet_to_github(sheet_name, new_df, base_version, operation_description, original_df=None, sheet_schema=None):
+    """حفظ شيت واحد فوق أحدث نسخة من باقي الشيتات
+    يُرفض الحفظ إذا تغير الشيت نفسه بعد أن بدأ المستخدم التعديل - يرجع رقم النسخة الجديد أو None
+    الكتابة المحلية تتم دائماً تحت workbook_lock (ملف Excel واحد). الرفع في وضع SHARDED_LAYOUT
+    يخص ملف هذه المحطة فقط فيتم بالتوازي مع حفظ المحطات الأخرى، وبدونه يُرفع الملف كاملاً
+    تحت push_lock فيُرفع حفظ المحطات المختلفة واحداً بعد الآخر
+    الصفوف المعدلة تُفحص أولاً، وأخطاؤها تُحفظ في st.session_state.validation_errors لعرضها في المحرر"""
+    validation_errors = st.session_state.setdefault("validation_errors", {})
+    if APP_CONFIG["VALIDATE_BEFORE_SAVE"] and original_df is not None:
+        errors = validate_sheet_changes(original_df, new_df, sheet_schema)
+        if not errors.empty:
+            validation_errors[sheet_name] = errors
+            st.error(f"⛔ لم يتم الحفظ: {len(errors)} مشكلة في {errors['الصف'].nunique()} صف. صحح القيم الموضحة في الجدول ثم أعد الحفظ.")
+            return None
+    validation_errors.pop(sheet_name, None)
+
+    registry = get_sheet_locks()
+    commit_message = _commit_message(operation_description)
+
+    with registry.lock(sheet_name), registry.pending_push():
+        with registry.workbook_lock:
+            latest = sync_sheet_versions(registry) or {}
+            if registry.version(sheet_name) != base_version:
+                st.error(f"⛔ تم تعديل '{sheet_name}' من مستخدم آخر أثناء تعديلك. اضغط '🔄 إعادة تحميل البيانات' ثم أعد التعديل.")
+                return None
+
+            # sha الملف على GitHub الذي بُني عليه الملف المحلي (الرفع فوقه فقط)
+            base_sha = None
+            if not APP_CONFIG["SHARDED_LAYOUT"] and os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+                base_sha = remote_base_sha(read_local_workbook_bytes())
+
+            # نستبدل هذا الشيت فقط ونبقي أحدث نسخة من باقي الشيتات
+            merged = dict(latest)
+            merged[sheet_name] = new_df
+            content = write_local_workbook(merged)
+            if content is None:
+                st.error("❌ فشل الحفظ التلقائي")
+                return None
+            # البصمات من الملف كما سيُقرأ (القيم بعد Excel قد تختلف في نوعها عن الداتافرام المعدل)
+            # وملفات المحطات تُرفع من نفس الشيتات حتى تطابق بصمات الـ manifest ما يُقرأ لاحقاً
+            written = sync_sheet_versions(registry) or merged
+            new_version = registry.version(sheet_name)
+
+        if APP_CONFIG["SHARDED_LAYOUT"]:
+            pushed = push_workbook_to_github(written, commit_message, content, sheet_name=sheet_name)
+        else:
+            with registry.push_lock:
+                pushed = push_workbook_to_github(written, commit_message, content, base_sha=base_sha)
+        if not pushed:
+            st.error("❌ فشل الحفظ التلقائي")
+            return None
+
+    st.success("✅ تم حفظ التغييرات تلقائياً في GitHub")
+    return new_version
+
+# -------------------------------
+# 🗄 أرشفة السجلات القديمة في ملفات سنوية (الملف النشط يبقى صغيراً)
+# -------------------------------
+def archive_cutoff():
+    """الصفوف الأقدم من هذا التاريخ تُنقل إلى الأرشيف"""
+    return pd.Timestamp.now().normalize() - pd.Timedelta(days=APP_CONFIG["ARCHIVE_AFTER_DAYS"])
+
+def archive_file_name(year):
+    stem = os.path.splitext(os.path.basename(APP_CONFIG["LOCAL_FILE"]))[0]
+    return f"{stem}_{year}.xlsx"
+
+def split_archivable_rows(sheets, cutoff):
+    """فصل الصفوف الأقدم من تاريخ القطع - يرجع (الشيتات النشطة، {سنة: {شيت: الصفوف المؤرشفة}})"""
+    date_col = APP_CONFIG["DATE_COLUMN"]
+    hot, cold = {}, {}
+    for name, df in sheets.items():
+        if date_col not in df.columns:
+            hot[name] = df
+            continue
+        dates = parse_date_column(df[date_col])
+        old = dates < cutoff  # الصفوف بدون تاريخ صالح تبقى في الملف النشط
+        if not old.any():
+            hot[name] = df
+            continue
+        hot[name] = df[~old].reset_index(drop=True)
+        for year, rows in df[old].groupby(dates[old].dt.year):
+            cold.setdefault(int(year), {})[name] = rows.reset_index(drop=True)
+    return hot, cold
+
+def _remote_status(error):
+    """رمز HTTP لخطأ GitHub (PyGithub أو requests) أو None لأخطاء الشبكة"""
+    status = getattr(error, "status", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = error.response.status_code
+    return status
+
+def _is_missing_remote_file(error):
+    """خطأ 404 فقط يعني أن الملف غير موجود على GitHub (أخطاء الشبكة وحد الطلبات و5xx ليست كذلك)"""
+    return _remote_status(error) == 404
+
+def _is_remote_conflict(error):
+    """409: الملف على GitHub لم يعد بالـ sha الذي بُني عليه الحفظ"""
+    return _remote_status(error) == 409
+
+def _archive_repo_path(year):
+    return f"{APP_CONFIG['ARCHIVE_DIR']}/{archive_file_name(year)}"
+
+def _local_archive_path(year, download=True, remote_sha=""):
+    """مسار ملف أرشيف السنة محلياً - يُحمّل من GitHub إذا لم يكن موجوداً أو اختلف عن نسخة GitHub
+    remote_sha: sha الملف في قائمة الأرشيف على GitHub (None = غير موجود هناك،
+    "" = غير معروف بدون توكن فيُحمّل الملف ويُقارن)
+    يرجع None إذا لم تُؤرشف تلك السنة بعد (404)، وأي خطأ آخر في التحميل يُرفع للمستدعي"""
+    path = os.path.join(APP_CONFIG["ARCHIVE_DIR"], archive_file_name(year))
+    if not download:
+        return path
+    local = None
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            local = f.read()
+    if remote_sha is None:
+        return path if local is not None else None
+    if local is not None and remote_sha and git_blob_sha(local) == remote_sha:
+        return path
+    try:
+        content = _download_repo_file(_archive_repo_path(year))
+    except Exception as e:
+        if _is_missing_remote_file(e):
+            return path if local is not None else None
+        raise
+    os.makedirs(APP_CONFIG["ARCHIVE_DIR"], exist_ok=True)
+    if local != content:
+        replace_local_file(content, path)
+    return path
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _load_archive_file(path, mtime_ns):
+    """قراءة ملف أرشيف سنة (مشترك للقراءة فقط - المفتاح يشمل وقت تعديل الملف)"""
+    with open(path, "rb") as f:
+        return MappingProxyType(parse_sheets_bytes(f.read()))
+
+@st.cache_data(show_spinner=False, ttl=600)
+def remote_archive_index():
+    """ملفات الأرشيف على GitHub {اسم الملف: sha} - None بدون توكن (رابط RAW لا يعطي قائمة)"""
+    token = st.secrets.get("github", {}).get("token", None)
+    if not (token and GITHUB_AVAILABLE):
+        return None
+    repo = github_client(token).get_repo(APP_CONFIG["REPO_NAME"])
+    try:
+        return {item.name: item.sha for item in repo.get_contents(APP_CONFIG["ARCHIVE_DIR"], ref=APP_CONFIG["BRANCH"])}
+    except Exception as e:
+        if not _is_missing_remote_file(e):
+            raise
+        return {}
+
+def remote_archive_sha(year):
+    """sha أرشيف السنة على GitHub ("" بدون توكن، None إذا لم يُنشأ هناك)"""
+    index = remote_archive_index()
+    if index is None:
+        return ""
+    return index.get(archive_file_name(year))
+
+@st.cache_data(show_spinner=False, ttl=600)
+def _archive_year_path(year, remote_sha=""):
+    """مسار أرشيف السنة أو None إذا لم تُؤرشف تلك السنة
+    المفتاح يشمل sha الملف على GitHub: إضافة صفوف من خادم آخر تعني مفتاحاً جديداً وتحميلاً جديداً
+    (بدون توكن يُعاد التحميل والمقارنة عند انتهاء مدة الكاش)"""
+    path = _local_archive_path(year, remote_sha=remote_sha)
+    return path if path and os.path.exists(path) else None
+
+def load_archived_rows(sheet_name, start, end):
+    """الصفوف المؤرشفة لشيت واحد بين تاريخين"""
+    frames = []
+    for year in range(start.year, end.year + 1):
+        try:
+            path = _archive_year_path(year, remote_archive_sha(year))
+        except Exception as e:
+            st.warning(f"⚠ تعذر تحميل أرشيف سنة {year} من GitHub: {e}")
+            continue
+        if not path:
+            continue
+        archived = _load_archive_file(path, os.stat(path).st_mtime_ns)
+        if sheet_name in archived:
+            frames.append(archived[sheet_name])
+    return frames
+
+@st.cache_data(show_spinner=False, ttl=600)
+def list_archive_years():
+    """سنوات ملفات الأرشيف الموجودة محلياً وعلى GitHub (خطأ غير 404 في القائمة يُرفع للمستدعي)"""
+    stem = os.path.splitext(os.path.basename(APP_CONFIG["LOCAL_FILE"]))[0]
+    pattern = re.compile(rf"^{re.escape(stem)}_(\d{{4}})\.xlsx$")
+    names = set(os.listdir(APP_CONFIG["ARCHIVE_DIR"])) if os.path.isdir(APP_CONFIG["ARCHIVE_DIR"]) else set()
+    names.update(remote_archive_index() or {})
+    return sorted(int(m.group(1)) for m in map(pattern.match, names) if m)
+
+def collect_archive_files():
+    """ملفات الأرشيف المتاحة للتحليلات - يرجع ([(السنة، المسار، وقت التعديل)]، رسائل السنوات التي تعذر تحميلها)"""
+    files, failed = [], []
+    try:
+        years = list_archive_years()
+    except Exception as e:
+        return files, [f"قائمة الأرشيف: {e}"]
+    for year in years:
+        try:
+            remote_sha = remote_archive_sha(year)
+            path = _archive_year_path(year, remote_sha)
+            if path and not os.path.exists(path):
+                # الملف المحلي حُذف بعد تخزين مساره - نحمّله من جديد
+                _archive_year_path.clear()
+                path = _archive_year_path(year, remote_sha)
+        except Exception as e:
+            failed.append(f"{year}: {e}")
+            continue
+        if path:
+            files.append((year, path, os.stat(path).st_mtime_ns))
+    return files, failed
+
+def fetch_remote_archive(repo, year):
+    """محتوى ملف أرشيف السنة على GitHub وبصمته (sha) - (None, None) إذا لم يُنشأ بعد (404 فقط)"""
+    try:
+        contents = repo.get_contents(_archive_repo_path(year), ref=APP_CONFIG["BRANCH"])
+    except Exception as e:
+        if _is_missing_remote_file(e):
+            return None, None
+        raise
+    return contents.decoded_content, contents.sha
+
+def merge_archive_rows(existing, year_sheets):
+    """إضافة الصفوف المؤرشفة الآن إلى محتوى ملف الأرشيف
+    الصفوف الموجودة فيه مسبقاً لا تتكرر (إعادة أرشفة بعد فشل رفع الملف النشط)"""
+    merged = dict(existing)
+    for name, rows in year_sheets.items():
+        if name not in merged:
+            merged[name] = rows
+            continue
+        base = merged[name]
+        known = pd.util.hash_pandas_object(base.reindex(columns=rows.columns).astype(object), index=False)
+        fresh = ~pd.util.hash_pandas_object(rows.astype(object), index=False).isin(set(known)).to_numpy()
+        merged[name] = pd.concat([base, rows[fresh]], ignore_index=True)
+    return merged
+
+def push_archive_files(repo, files, commit_message):
+    """رفع ملفات الأرشيف المعدلة إلى GitHub - files: [(المسار المحلي، sha النسخة التي بُني عليها أو None)]
+    إذا تغير الملف على GitHub بعد تحميله يفشل الرفع بدلاً من استبدال ما أضافه غيرنا"""
+    try:
+        for path, sha in files:
+            repo_path = f"{APP_CONFIG['ARCHIVE_DIR']}/{os.path.basename(path)}"
+            with open(path, "rb") as f:
+                content = f.read()
+            if sha:
+                repo.update_file(path=repo_path, message=commit_message, content=content, sha=sha, branch=APP_CONFIG["BRANCH"])
+            else:
+                repo.create_file(path=repo_path, message=commit_message, content=content, branch=APP_CONFIG["BRANCH"])
+        return True
+    except Exception as e:
+        st.error(f"❌ فشل رفع ملفات الأرشيف إلى GitHub: {e}")
+        return False
+
+def archive_old_rows():
+    """نقل الصفوف الأقدم من ARCHIVE_AFTER_DAYS إلى ملفات الأرشيف السنوية ثم حفظ الملف النشط
+    يرجع عدد الصفوف المنقولة أو None عند الفشل"""
+    registry = get_sheet_locks()
+    commit_message = _commit_message("أرشفة السجلات القديمة")
+    token = st.secrets.get("github", {}).get("token", None)
+
+    # من كتابة الأرشيف والملف النشط حتى رفعهما: المراقب لا يستبدل الملف المحلي
+    with registry.pending_push():
+        with registry.workbook_lock:
+            latest = load_all_sheets()
+            if not latest:
+                return 0
+            hot, cold = split_archivable_rows(latest, archive_cutoff())
+            if not cold:
+                return 0
+
+            # كل ملف أرشيف يُبنى فوق أحدث نسخة على GitHub (أو النسخة المحلية بدون توكن)
+            # أي خطأ غير 404 يوقف الأرشفة قبل كتابة أي ملف
+            repo = None
+            files = []
+            try:
+                if token and GITHUB_AVAILABLE:
+                    repo = github_client(token).get_repo(APP_CONFIG["REPO_NAME"])
+                os.makedirs(APP_CONFIG["ARCHIVE_DIR"], exist_ok=True)
+                for year, year_sheets in sorted(cold.items()):
+                    path = _local_archive_path(year, download=False)
+                    sha = None
+                    if repo is not None:
+                        content, sha = fetch_remote_archive(repo, year)
+                    elif os.path.exists(path):
+                        with open(path, "rb") as f:
+                            content = f.read()
+                    else:
+                        content = None
+                    existing = parse_sheets_bytes(content) if content else {}
+                    write_workbook_file(merge_archive_rows(existing, year_sheets), path)
+                    files.append((path, sha))
+            except Exception as e:
+                st.error(f"❌ تم إيقاف الأرشفة - تعذر تجهيز ملفات الأرشيف: {e}")
+                return None
+            _archive_year_path.clear()
+            list_archive_years.clear()
+            remote_archive_index.clear()
+
+            # الأرشيف يُرفع أولاً: الصفوف لا تُحذف من الملف النشط إلا بعد وصولها إلى GitHub
+            if repo is not None:
+                with registry.push_lock:
+                    if not push_archive_files(repo, files, commit_message):
+                        return None
+
+            base_sha = None
+            if not APP_CONFIG["SHARDED_LAYOUT"]:
+                base_sha = remote_base_sha(read_local_workbook_bytes())
+            content = write_local_workbook(hot)
+            if content is None:
+                return None
+            hot = sync_sheet_versions(registry) or hot
+
+        with registry.push_lock:
+            if not push_workbook_to_github(hot, commit_message, content, base_sha=base_sha):
+                return None
+    return sum(len(rows) for year_sheets in cold.values() for rows in year_sheets.values())
 
 # -------------------------------
 # 🧰 دوال مساعدة للمعالجة والنصوص
@@ -422,6 +1837,62 @@ def create_backup():
         st.error(f"❌ خطأ في إنشاء النسخة الاحتياطية: {e}")
         return None
 
+@st.cache_data(show_spinner=False, max_entries=4)
+def compute_reliability_analytics(version, freq, archive_files=()):
+    """تحليلات الأعطال لكل المحطات (محسوبة مرة واحدة لكل نسخة من الملف ولكل فترة)
+    archive_files: ملفات الأرشيف المضافة للملف النشط [(السنة، المسار، وقت التعديل)]"""
+    sources = [_load_workbook_version(version) or {}]
+    sources += [_load_archive_file(path, mtime_ns) for _, path, mtime_ns in archive_files]
+    event_col, date_col = APP_CONFIG["EVENT_COLUMN"], APP_CONFIG["DATE_COLUMN"]
+
+    # جدول واحد طويل بكل الأحداث من كل الشيتات (النشطة والمؤرشفة)
+    frames = [
+        pd.DataFrame({"station": name, "event": df[event_col], "date": df[date_col]})
+        for sheets in sources
+        for name, df in sheets.items()
+        if event_col in df.columns and date_col in df.columns
+    ]
+    if not frames:
+        return None
+    events = pd.concat(frames, ignore_index=True)
+    events["station"] = events["station"].astype("category")
+    events["date"] = parse_date_column(events["date"])
+    events["event"] = events["event"].astype("string").str.strip()
+    events = events[events["date"].notna() & events["event"].fillna("").ne("")]
+    if events.empty:
+        return None
+
+    # عدد الأحداث لكل محطة في كل أسبوع/شهر
+    per_period = (
+        events.groupby([pd.Grouper(key="date", freq=freq), "station"], observed=True)
+        .size()
+        .unstack("station", fill_value=0)
+        .asfreq(freq, fill_value=0)
+    )
+
+    # متوسط الوقت بين الأعطال = متوسط الفرق بين كل حدث والذي قبله في نفس المحطة
+    events = events.sort_values(["station", "date"])
+    gap_days = events.groupby("station", observed=True)["date"].diff().dt.total_seconds() / 86400
+    summary = (
+        events.assign(gap_days=gap_days)
+        .groupby("station", observed=True)
+        .agg(events=("event", "size"), first=("date", "min"), last=("date", "max"), mtbf_days=("gap_days", "mean"))
+        .sort_values("events", ascending=False)
+    )
+
+    # أكثر الأحداث تكراراً في كل محطة
+    recurring = (
+        events.groupby(["station", "event"], observed=True)
+        .size()
+        .rename("count")
+        .reset_index()
+        .query("count > 1")
+        .sort_values("count", ascending=False)
+        .head(APP_CONFIG["TOP_RECURRING_EVENTS"])
+    )
+
+    return {"per_period": per_period, "summary": summary, "recurring": recurring}
+
 def separate_mandatory_columns(all_columns):
     """فصل الأعمدة الإلزامية عن الأعمدة العادية"""
     mandatory_cols = [col for col in APP_CONFIG["MANDATORY_COLUMNS"] if col in all_columns]
@@ -449,6 +1920,11 @@ def detect_dataframe_changes(original_df, new_df):
 # -------------------------------
 st.set_page_config(page_title=APP_CONFIG["APP_TITLE"], layout="wide")
 
+# مهام الخلفية (مرة واحدة لكل عملية): تجهيز كاش الملف ومراقبة التحديثات على GitHub
+# لا تؤخر ظهور شاشة الدخول - الملف نفسه لا يُحمّل في هذا التشغيل قبل تسجيل الدخول
+start_boot_warmup()
+start_upstream_watcher()
+
 # شريط تسجيل الدخول
 with st.sidebar:
     st.header("👤 الجلسة")
@@ -480,6 +1956,26 @@ with st.sidebar:
         else:
             st.error("❌ فشل في تحديث البيانات")
     
+    # تحميل الملف المجمع بكل الشيتات (في وضع التقسيم يُجمع من ملفات المحطات)
+    # الملف يُقرأ عند الضغط فقط وليس مع كل إعادة تشغيل للسكربت
+    if os.path.exists(APP_CONFIG["LOCAL_FILE"]):
+        st.download_button(
+            "📥 تحميل ملف المحطات كاملاً",
+            data=read_local_workbook_bytes,
+            file_name=os.path.basename(APP_CONFIG["LOCAL_FILE"]),
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
+    
+    if st.button("🗄 أرشفة السجلات القديمة", use_container_width=True,
+                 help=f"نقل الصفوف الأقدم من {APP_CONFIG['ARCHIVE_AFTER_DAYS']} يوم إلى ملفات أرشيف سنوية"):
+        with st.spinner("جاري الأرشفة..."):
+            moved = archive_old_rows()
+        if moved:
+            st.success(f"✅ تم نقل {moved} صف إلى الأرشيف")
+        elif moved == 0:
+            st.info("ℹ لا توجد سجلات أقدم من فترة الأرشفة")
+    
     if st.button("💾 إنشاء نسخة احتياطية", use_container_width=True):
         backup_file = create_backup()
         if backup_file:
@@ -490,6 +1986,7 @@ with st.sidebar:
     if st.button("🗑 مسح الكاش", use_container_width=True):
         try:
             st.cache_data.clear()
+            _load_workbook_version.clear()
             st.success("✅ تم مسح الكاش بنجاح")
             st.rerun()
         except Exception as e:
@@ -545,6 +2042,25 @@ with tabs[0]:
             
             st.subheader(f"بيانات {selected_sheet}")
             
+            # فلترة حسب التاريخ - السجلات المؤرشفة تُضاف فقط عند اختيار فترة أقدم من فترة الأرشفة
+            date_col = APP_CONFIG["DATE_COLUMN"]
+            if date_col in df.columns and st.checkbox("📅 فلترة حسب التاريخ", value=False, key="view_use_date_range"):
+                today = datetime.now().date()
+                date_range = st.date_input(
+                    "الفترة:",
+                    value=(today - timedelta(days=30), today),
+                    key="view_date_range"
+                )
+                if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+                    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+                    if start < archive_cutoff():
+                        archived = load_archived_rows(selected_sheet, start, min(end, archive_cutoff()))
+                        if archived:
+                            df = pd.concat(archived + [df], ignore_index=True)
+                            st.caption(f"🗄 تم تضمين {sum(len(a) for a in archived)} صف من الأرشيف")
+                    dates = parse_date_column(df[date_col])
+                    df = df[(dates >= start) & (dates < end + pd.Timedelta(days=1))]
+            
             # قسم تخصيص الأعمدة - معدل
             st.subheader("🎛 تخصيص الأعمدة المعروضة")
             
@@ -683,7 +2199,16 @@ with tabs[1]:
             # تحميل البيانات الأصلية
             original_df = sheets_edit[selected_sheet]
             
+            # رقم نسخة الشيت عند بدء التعديل (يُرفض الحفظ إذا عدّله مستخدم آخر بعدها)
+            base_versions = st.session_state.setdefault("edit_base_versions", {})
+            latest_version = current_sheet_version(selected_sheet)
+            if selected_sheet not in base_versions:
+                base_versions[selected_sheet] = latest_version
+            base_version = base_versions[selected_sheet]
+            
             st.subheader(f"تعديل بيانات {selected_sheet}")
+            if latest_version != base_version:
+                st.warning("⚠ تم تعديل هذه المحطة من مستخدم آخر بعد أن بدأت. اضغط '🔄 إعادة تحميل البيانات' قبل الحفظ.")
             
             # عرض حالة الحفظ التلقائي
             st.success("💾 الحفظ التلقائي مفعّل - سيتم حفظ جميع التغييرات تلقائياً على GitHub")
@@ -697,7 +2222,8 @@ with tabs[1]:
             
             # إعادة ترتيب الأعمدة لوضع الإلزامية أولاً
             ordered_columns = mandatory_columns + [col for col in all_columns if col not in mandatory_columns]
-            df_reordered = original_df[ordered_columns]
+            sheet_schema = sheet_schema_for_edit(get_workbook_version(), selected_sheet, original_df)
+            df_reordered = editor_frame(original_df[ordered_columns])
             
             # محرر البيانات
             edited_df = st.data_editor(
@@ -706,12 +2232,7 @@ with tabs[1]:
                 height=500,
                 num_rows="dynamic",
                 key=f"editor_{selected_sheet}",
-                column_config={
-                    col: st.column_config.TextColumn(
-                        col,
-                        help=f"يمكنك إدخال أي نوع من البيانات في عمود {col}"
-                    ) for col in df_reordered.columns
-                }
+                column_config=build_column_config(df_reordered, sheet_schema)
             )
             
             # زر حفظ منفصل
@@ -722,13 +2243,16 @@ with tabs[1]:
                     # التحقق من وجود تغييرات
                     if detect_dataframe_changes(df_reordered, edited_df):
                         with st.spinner("جاري الحفظ على GitHub..."):
-                            sheets_edit[selected_sheet] = edited_df
-                            new_sheets = auto_save_to_github(
-                                sheets_edit,
-                                f"تعديل تلقائي في شيت {selected_sheet}"
+                            new_version = save_sheet_to_github(
+                                selected_sheet,
+                                edited_df,
+                                base_version,
+                                f"تعديل تلقائي في شيت {selected_sheet}",
+                                original_df=df_reordered,
+                                sheet_schema=sheet_schema
                             )
-                            if new_sheets is not None:
-                                sheets_edit = new_sheets
+                            if new_version is not None:
+                                base_versions[selected_sheet] = new_version
                                 st.success("✅ تم الحفظ بنجاح على GitHub")
                                 st.rerun()
                     else:
@@ -736,6 +2260,8 @@ with tabs[1]:
             
             with col2:
                 if st.button("🔄 إعادة تحميل البيانات", use_container_width=True):
+                    base_versions.pop(selected_sheet, None)
+                    st.session_state.get("validation_errors", {}).pop(selected_sheet, None)
                     st.rerun()
             
             # تصدير البيانات
@@ -800,24 +2326,99 @@ with tabs[1]:
                             if col not in new_row_data:
                                 new_row_data[col] = ""
                         
-                        new_df = pd.concat([edited_df, pd.DataFrame([new_row_data])], ignore_index=True)
+                        new_row = coerce_row_to_schema(new_row_data, sheet_schema)
+                        # رقم جديد للصف بدل إعادة ترقيم الكل: أرقام الصفوف في رسائل التحقق تطابق المحرر
+                        next_label = edited_df.index.max() + 1 if len(edited_df) else 0
+                        new_df = pd.concat([edited_df, pd.DataFrame([new_row], index=[next_label])])
                         with st.spinner("جاري إضافة الصف والحفظ على GitHub..."):
-                            sheets_edit[selected_sheet] = new_df
-                            new_sheets = auto_save_to_github(
-                                sheets_edit,
-                                f"إضافة صف جديد في {selected_sheet}"
+                            new_version = save_sheet_to_github(
+                                selected_sheet,
+                                new_df,
+                                base_version,
+                                f"إضافة صف جديد في {selected_sheet}",
+                                original_df=df_reordered,
+                                sheet_schema=sheet_schema
                             )
-                            if new_sheets is not None:
-                                sheets_edit = new_sheets
+                            if new_version is not None:
+                                base_versions[selected_sheet] = new_version
                                 st.success("✅ تم إضافة الصف الجديد والحفظ بنجاح")
                                 st.rerun()
                     else:
                         st.warning("⚠ يرجى إدخال بيانات في الحقول")
+            
+            # أخطاء التحقق من آخر محاولة حفظ (تبقى ظاهرة حتى الحفظ الناجح أو إعادة التحميل)
+            sheet_errors = st.session_state.get("validation_errors", {}).get(selected_sheet)
+            if sheet_errors is not None and not sheet_errors.empty:
+                st.subheader("⛔ أخطاء التحقق من البيانات")
+                st.warning(f"⚠ صفوف بها مشاكل في آخر محاولة حفظ: {', '.join(map(str, sheet_errors['الصف'].unique()))}")
+                st.dataframe(sheet_errors, use_container_width=True, hide_index=True)
 
 # -------------------------------
-# Tab 3: إدارة المستخدمين
+# Tab 3: تحليلات الأعطال (عدد الأحداث، MTBF، الأحداث المتكررة)
 # -------------------------------
 with tabs[2]:
+    st.header("📈 تحليلات الأعطال لكل محطة")
+    
+    if not production_data:
+        st.warning("⚠ لا توجد بيانات متاحة. يرجى تحديث الملف من GitHub.")
+    else:
+        period = st.radio("📅 الفترة:", ["أسبوعي", "شهري"], horizontal=True, key="analytics_period")
+        archive_files, failed_archives = [], []
+        if st.checkbox("🗄 تضمين السجلات المؤرشفة", value=True, key="analytics_include_archive"):
+            archive_files, failed_archives = collect_archive_files()
+        if archive_files:
+            st.caption(f"📚 التحليلات تشمل الملف النشط وأرشيف سنوات: {', '.join(str(year) for year, _, _ in archive_files)}")
+        else:
+            st.caption(f"ℹ التحليلات تغطي الملف النشط فقط (السجلات الأقدم من {APP_CONFIG['ARCHIVE_AFTER_DAYS']} يوم تُنقل إلى الأرشيف).")
+        if failed_archives:
+            st.warning("⚠ تعذر تحميل بعض ملفات الأرشيف - التحليلات لا تشملها: " + " | ".join(failed_archives))
+        analytics = compute_reliability_analytics(
+            get_workbook_version(),
+            "W" if period == "أسبوعي" else "MS",
+            tuple(archive_files)
+        )
+        
+        if analytics is None:
+            st.info(f"ℹ لا توجد أحداث مسجلة بتاريخ صحيح في عمودي '{APP_CONFIG['EVENT_COLUMN']}' و '{APP_CONFIG['DATE_COLUMN']}'.")
+        else:
+            summary = analytics["summary"]
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("🔢 إجمالي الأحداث", int(summary["events"].sum()))
+            with col2:
+                st.metric("🏭 محطات بها أحداث", len(summary))
+            with col3:
+                overall_mtbf = summary["mtbf_days"].mean()
+                st.metric("⏱ متوسط MTBF (يوم)", f"{overall_mtbf:.1f}" if pd.notna(overall_mtbf) else "-")
+            
+            st.subheader("📊 عدد الأحداث لكل محطة")
+            st.bar_chart(analytics["per_period"])
+            
+            st.subheader("⏱ متوسط الوقت بين الأعطال (MTBF)")
+            st.dataframe(
+                summary.rename(columns={
+                    "events": "عدد الأحداث",
+                    "first": "أول حدث",
+                    "last": "آخر حدث",
+                    "mtbf_days": "MTBF (يوم)"
+                }).rename_axis("المحطة"),
+                use_container_width=True
+            )
+            
+            st.subheader("🔁 أكثر الأحداث تكراراً")
+            if analytics["recurring"].empty:
+                st.info("ℹ لا توجد أحداث متكررة.")
+            else:
+                st.dataframe(
+                    analytics["recurring"].rename(columns={"station": "المحطة", "event": "الحدث", "count": "عدد المرات"}),
+                    use_container_width=True,
+                    hide_index=True
+                )
+
+# -------------------------------
+# Tab 4: إدارة المستخدمين
+# -------------------------------
+with tabs[3]:
     st.header("👥 إدارة المستخدمين")
     
     users = load_users()
@@ -869,9 +2470,9 @@ with tabs[2]:
                 st.rerun()
 
 # -------------------------------
-# Tab 4: الدعم الفني
+# Tab 5: الدعم الفني
 # -------------------------------
-with tabs[3]:
+with tabs[4]:
     st.header("📞 الدعم الفني")
     
     st.markdown("## 🛠 معلومات التطوير والدعم")
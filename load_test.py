@@ -0,0 +1,462 @@
+"""
+اختبار تحميل لعدة جلسات متزامنة على app.py
+
+يشغل جلسات Streamlit حقيقية (streamlit.testing.v1.AppTest) على نسخة مؤقتة من التطبيق
+مع GitHub وهمي، ويقيس زمن كل إجراء (تسجيل الدخول، تبديل الشيت، فتح التحرير، إضافة صف
+وحفظ، تعديل خلية وحفظ) وأقصى استهلاك للذاكرة مع زيادة عدد الجلسات.
+تسجيل الدخول يتم لجلسة واحدة في كل مرة (state.json بدون قفل)، ثم تعمل الجلسات معاً.
+أي مستوى فشلت فيه جلسة يُطبع كنتيجة غير صالحة.
+
+الاستخدام:
+    python load_test.py --levels 1,2,5,10 --rounds 3 --github-latency 0.05
+"""
+import argparse
+import base64
+import hashlib
+import importlib.machinery
+import itertools
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import streamlit as st
+import streamlit.logger
+from streamlit.components.v2.component_manager import BidiComponentManager
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ACTIONS = ["login", "view_switch", "edit_switch", "add_row_save", "edit_save"]
+# رقم يزيد عبر كل المستويات: كل نص يُكتب جديد فلا يعيد techN كتابة قيمته من المستوى السابق
+EDIT_COUNTER = itertools.count(1)
+# مفتاح في session_state تطلب به الجلسة تعديل خلية في محرر البيانات (انظر install_editor_edits)
+EDIT_KEY = "_load_test_edit"
+DATE_COLUMN = "التاريخ"  # APP_CONFIG["DATE_COLUMN"] - لا نكتب فيه نصاً
+
+
+# -------------------------------
+# 🐙 GitHub وهمي (PyGithub + روابط RAW + commits API)
+# -------------------------------
+class FakeNotFound(Exception):
+    """مثل UnknownObjectException في PyGithub (status = 404)"""
+    status = 404
+
+
+class FakeGithubError(Exception):
+    """مثل GithubException في PyGithub (409 تعارض sha، 422 ملف موجود)"""
+
+    def __init__(self, status, message):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+
+
+class FakeContentFile:
+    def __init__(self, content):
+        self.decoded_content = content
+        self.content = base64.b64encode(content).decode("ascii")
+        # نفس sha الذي يرجعه GitHub (git blob)
+        self.sha = hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class FakeRepo:
+    """مستودع في الذاكرة يحاكي تعارض الـ sha وزمن الشبكة"""
+
+    def __init__(self, files, latency):
+        self.files = dict(files)
+        self.latency = latency
+        self.head = hashlib.sha1(b"initial").hexdigest()
+        self.commits = 0
+        self._lock = threading.Lock()
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_contents(self, path, ref=None):
+        self._delay()
+        with self._lock:
+            if path not in self.files:
+                raise FakeNotFound(f"404: {path}")
+            return FakeContentFile(self.files[path])
+
+    def _put(self, path, content, message):
+        content = content.encode("utf-8") if isinstance(content, str) else content
+        self.files[path] = content
+        self.commits += 1
+        self.head = hashlib.sha1(f"{self.head}{message}{time.time()}".encode()).hexdigest()
+        return {"content": FakeContentFile(content), "commit": types.SimpleNamespace(sha=self.head)}
+
+    def create_file(self, path, message, content, branch=None):
+        self._delay()
+        with self._lock:
+            if path in self.files:
+                raise FakeGithubError(422, f"{path} already exists")
+            return self._put(path, content, message)
+
+    def update_file(self, path, message, content, sha, branch=None):
+        self._delay()
+        with self._lock:
+            if path not in self.files:
+                raise FakeNotFound(f"404: {path}")
+            if FakeContentFile(self.files[path]).sha != sha:
+                raise FakeGithubError(409, f"{path} does not match {sha}")
+            return self._put(path, content, message)
+
+    def delete_file(self, path, message, sha, branch=None):
+        self._delay()
+        with self._lock:
+            self.files.pop(path, None)
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.raw = types.SimpleNamespace(read=_chunked_reader(content))
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            error = Exception(f"HTTP {self.status_code}")
+            error.response = self
+            raise error
+
+
+def _chunked_reader(content):
+    state = {"pos": 0}
+
+    def read(size=-1, *args, **kwargs):
+        start = state["pos"]
+        end = len(content) if size is None or size < 0 else start + size
+        state["pos"] = min(end, len(content))
+        return content[start:state["pos"]]
+    return read
+
+
+def install_fake_github(repo):
+    """استبدال PyGithub و requests.get بنسخ وهمية تستخدم نفس المستودع"""
+    class FakeGithub:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def get_repo(self, name):
+            return repo
+
+    module = types.ModuleType("github")
+    module.Github = FakeGithub
+    module.__spec__ = importlib.machinery.ModuleSpec("github", None)
+    sys.modules["github"] = module
+
+    import requests
+
+    def fake_get(url, *args, **kwargs):
+        repo._delay()
+        if "/commits" in url:
+            return FakeResponse(200, json.dumps([{"sha": repo.head}]).encode(), {"ETag": repo.head})
+        path = url.split("/raw/", 1)[-1].split("/", 1)[-1]
+        from urllib.parse import unquote
+        content = repo.files.get(unquote(path))
+        return FakeResponse(200, content) if content is not None else FakeResponse(404)
+
+    requests.get = fake_get
+
+
+# -------------------------------
+# 🧵 Runtime مشترك لكل الجلسات
+# -------------------------------
+def install_shared_runtime(secrets):
+    """
+    AppTest يبدل Runtime._instance و st.secrets مع كل تشغيل ويترجم السكربت من جديد،
+    وهذا لا يصلح لعدة جلسات في threads متوازية (وترجمة ast في CPython 3.11 غير آمنة بين threads).
+    هنا نثبت Runtime واحد وكاش سكربت واحد للعملية كلها، كما يحدث في خادم Streamlit الحقيقي.
+    """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+    shared_cache = ScriptCache()
+    get_bytecode = ScriptCache.get_bytecode
+    ScriptCache.get_bytecode = lambda self, script_path: get_bytecode(shared_cache, script_path)
+
+    new_secrets = Secrets()
+    new_secrets._secrets = secrets
+    st.secrets = new_secrets
+
+
+def install_editor_edits():
+    """
+    AppTest لا يستطيع الكتابة في st.data_editor، فنلفه ليرجع الجدول مع تعديل أول خلية نصية
+    في الصف الأول عندما تطلب الجلسة ذلك (st.session_state[EDIT_KEY] = النص).
+    هكذا يمر زر الحفظ بالمسار الحقيقي: اكتشاف التغيير، التحقق، الأقفال، الكتابة والرفع.
+    """
+    data_editor = st.data_editor
+
+    def edited_data_editor(data, *args, **kwargs):
+        edited = data_editor(data, *args, **kwargs)
+        text = st.session_state.get(EDIT_KEY)
+        columns = [col for col in edited.columns if edited[col].dtype == object and col != DATE_COLUMN]
+        if text and columns and len(edited):
+            edited = edited.copy()
+            edited.iloc[0, edited.columns.get_loc(columns[0])] = text
+        return edited
+
+    st.data_editor = edited_data_editor
+
+
+# -------------------------------
+# 👥 جلسة محاكاة واحدة
+# -------------------------------
+class SimulatedSession:
+    def __init__(self, app_path, username, password, timeout):
+        self.username = username
+        self.password = password
+        self.at = AppTest.from_file(app_path, default_timeout=timeout)
+
+    def open(self):
+        self.at.run()
+
+    def login(self):
+        self.at.sidebar.selectbox[0].set_value(self.username)
+        self.at.sidebar.text_input[0].set_value(self.password)
+        self.at.sidebar.button[0].click().run()
+        self.require_login("login")
+
+    def require_login(self, action):
+        # state.json مشترك بين الجلسات؛ فقدان سجل الجلسة يعيد المستخدم لشاشة الدخول
+        if "logged_in" not in self.at.session_state or not self.at.session_state["logged_in"]:
+            raise RuntimeError(f"not logged in after {action}: {self.messages()}")
+
+    def sheets(self):
+        self.require_login("login")
+        return self.at.selectbox(key="view_sheet_select").options
+
+    def view_switch(self, sheet):
+        self.require_login("view_switch")
+        self.at.selectbox(key="view_sheet_select").set_value(sheet).run()
+
+    def edit_switch(self, sheet):
+        self.require_login("edit_switch")
+        self.at.selectbox(key="edit_sheet_select").set_value(sheet).run()
+
+    def add_row_save(self, text):
+        inputs = [t for t in self.at.text_input if t.key and t.key.startswith("new_")]
+        inputs[0].set_value(text)
+        [b for b in self.at.button if "إضافة صف" in str(b.label)][0].click().run()
+
+    def edit_save(self, text):
+        self.at.session_state[EDIT_KEY] = text
+        [b for b in self.at.button if "حفظ التغييرات" in str(b.label)][0].click().run()
+        self.at.session_state[EDIT_KEY] = None
+        if any("لم يتم إجراء أي تغييرات" in str(i.value) for i in self.at.info):
+            raise RuntimeError("edit_save did not change the sheet")
+        if self.at.error:
+            raise RuntimeError(f"edit_save refused: {[e.value for e in self.at.error]}")
+
+    def errors(self):
+        return [e.value for e in self.at.exception]
+
+    def messages(self):
+        return self.errors() + [e.value for e in self.at.error] + [w.value for w in self.at.warning]
+
+
+# -------------------------------
+# 📈 قياس الذاكرة والنتائج
+# -------------------------------
+class PeakMemorySampler:
+    """أقصى RSS للعملية أثناء مستوى تزامن واحد (من /proc على لينكس وإلا ru_maxrss)"""
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except Exception:
+            scale = 1 if sys.platform == "darwin" else 1024
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current_rss())
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    k = (len(ordered) - 1) * q
+    low, high = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (k - low)
+
+
+def run_level(app_path, sessions, rounds, timeout):
+    """تشغيل عدد من الجلسات بالتوازي - يرجع (الأزمنة لكل إجراء، الأخطاء، أقصى ذاكرة)"""
+    timings = {action: [] for action in ACTIONS}
+    failures = []
+    lock = threading.Lock()
+
+    users = [(f"tech{i}", f"pw{i}") for i in range(sessions)]
+    opened = []
+    for username, password in users:
+        session = SimulatedSession(app_path, username, password, timeout)
+        session.open()
+        opened.append(session)
+
+    barrier = threading.Barrier(sessions)
+    logged_in = threading.Barrier(sessions)
+    # state.json في التطبيق يُقرأ ويُكتب بدون قفل: تسجيلات دخول متزامنة تفقد بعضها، وقراءته
+    # أثناء كتابة جلسة أخرى تخرج المستخدم. لذلك تسجل الجلسات دخولها واحدة تلو الأخرى ثم تبدأ الجولات معاً
+    login_lock = threading.Lock()
+
+    def timed(action, fn, *args):
+        start = time.perf_counter()
+        fn(*args)
+        elapsed = time.perf_counter() - start
+        with lock:
+            timings[action].append(elapsed)
+
+    def fail(session, error):
+        with lock:
+            failures.append(f"{session.username}: {error!r} {session.messages()[:3]}")
+
+    def scenario(index, session):
+        try:
+            barrier.wait()
+            with login_lock:
+                timed("login", session.login)
+        except Exception as e:
+            fail(session, e)
+            logged_in.wait()
+            return
+        logged_in.wait()
+
+        try:
+            sheets = session.sheets()
+            # كل جلسة تعدل محطات لا تعدلها جلسة أخرى (إلا إذا زادت الجلسات عن عدد المحطات)
+            # وإلا يرفض التطبيق الحفظ - وهو سلوك صحيح - فيُحسب فشلاً
+            own = sheets[index % len(sheets)::sessions] or [sheets[index % len(sheets)]]
+            for r in range(rounds):
+                sheet = own[r % len(own)]
+                timed("view_switch", session.view_switch, sheet)
+                timed("edit_switch", session.edit_switch, sheet)
+                timed("add_row_save", session.add_row_save, f"load-test {session.username} #{next(EDIT_COUNTER)}")
+                timed("edit_save", session.edit_save, f"load-test edit {session.username} #{next(EDIT_COUNTER)}")
+                if session.errors():
+                    raise RuntimeError(session.errors()[0])
+        except Exception as e:
+            fail(session, e)
+
+    with PeakMemorySampler() as memory:
+        threads = [threading.Thread(target=scenario, args=(i, s)) for i, s in enumerate(opened)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    return timings, failures, memory.peak
+
+
+def prepare_workdir(workbook, max_sessions):
+    """نسخة مؤقتة من التطبيق والملف مع مستخدمين للاختبار"""
+    workdir = tempfile.mkdtemp(prefix="luva-load-")
+    shutil.copy(os.path.join(HERE, "app.py"), workdir)
+    shutil.copy(workbook, os.path.join(workdir, "station.xlsx"))
+    users = {
+        f"tech{i}": {
+            "password": f"pw{i}",
+            "role": "admin",
+            "permissions": ["all"],
+            "created_at": datetime.now().isoformat(),
+            "full_name": f"فني {i}"
+        }
+        for i in range(max_sessions)
+    }
+    with open(os.path.join(workdir, "users.json"), "w", encoding="utf-8") as f:
+        json.dump(users, f, ensure_ascii=False)
+    return workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="اختبار تحميل لجلسات متزامنة على app.py")
+    parser.add_argument("--levels", default="1,2,5,10", help="أعداد الجلسات المتزامنة (مفصولة بفواصل)")
+    parser.add_argument("--rounds", type=int, default=3, help="عدد مرات تكرار السيناريو لكل جلسة")
+    parser.add_argument("--workbook", default=os.path.join(HERE, "station.xlsx"))
+    parser.add_argument("--github-latency", type=float, default=0.05, help="زمن الشبكة الوهمي لكل طلب GitHub (ثانية)")
+    parser.add_argument("--timeout", type=float, default=120, help="أقصى زمن لإعادة تشغيل السكربت (ثانية)")
+    args = parser.parse_args()
+
+    levels = [int(x) for x in args.levels.split(",") if x.strip()]
+    streamlit.logger.set_log_level("error")
+    workdir = prepare_workdir(args.workbook, max(levels))
+    with open(args.workbook, "rb") as f:
+        repo = FakeRepo({"station.xlsx": f.read()}, args.github_latency)
+    install_fake_github(repo)
+    install_shared_runtime({"github": {"token": "load-test"}})
+    install_editor_edits()
+
+    os.chdir(workdir)
+    app_path = os.path.join(workdir, "app.py")
+    print(f"📁 {workdir}")
+    print(f"{'sessions':>8}  {'action':<13}{'n':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+
+    for level in levels:
+        # كل مستوى يبدأ بدون جلسات نشطة مسجلة
+        with open(os.path.join(workdir, "state.json"), "w", encoding="utf-8") as f:
+            json.dump({}, f)
+        commits_before = repo.commits
+        timings, failures, peak = run_level(app_path, level, args.rounds, args.timeout)
+        for action in ACTIONS:
+            values = timings[action]
+            print(
+                f"{level:>8}  {action:<13}{len(values):>5}"
+                f"{percentile(values, 0.50) * 1000:>10.1f}"
+                f"{percentile(values, 0.95) * 1000:>10.1f}"
+                f"{percentile(values, 0.99) * 1000:>10.1f}"
+                f"{(max(values) if values else float('nan')) * 1000:>10.1f}"
+            )
+        print(f"{level:>8}  peak RSS: {peak / (1 << 20):.1f} MB | GitHub commits: {repo.commits - commits_before}" + (f" | ⚠ {len(failures)} failures" if failures else ""))
+        if failures:
+            # الأزمنة هنا من الجلسات التي بقيت فقط - لا تمثل هذا العدد من الجلسات المتزامنة
+            print(f"{'':>10}⛔ INVALID: {len(failures)}/{level} sessions failed, timings above are not valid for {level} sessions")
+        for failure in failures[:5]:
+            print(f"{'':>10}- {failure}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+دوال تحليل شيتات Excel داخل عمليات منفصلة (process pool)
+
+وحدة صغيرة مستقلة عن app.py حتى تستوردها العمليات الفرعية (spawn) دون تشغيل واجهة Streamlit.
+"""
+import io
+
+import pandas as pd
+from openpyxl import load_workbook
+
+
+def sheet_sizes(content):
+    """عدد الصفوف المسجل لكل شيت (من أبعاد الشيت في الملف) لتوزيع العمل بين العمليات"""
+    workbook = load_workbook(io.BytesIO(content), read_only=True, data_only=True, keep_links=False)
+    try:
+        return {name: workbook[name].max_row or 0 for name in workbook.sheetnames}
+    finally:
+        workbook.close()
+
+
+def read_sheets(content, names):
+    """قراءة الشيتات المحددة فقط كقيم خام (dtype=object)
+    pandas يفتح الملف بـ openpyxl في وضع read-only فتُقرأ صفوف هذه الشيتات وحدها كتدفق"""
+    return pd.read_excel(io.BytesIO(content), sheet_name=list(names), dtype=object)